@@ -2,7 +2,7 @@ $(document).ready(function() {
     $("#action-modal").on("shown.bs.modal", function(e) {
         $("#action-modal-content [autofocus]").focus();
     });
-    $("a[rel='modal']").click(function(ev) {
+    $(document).on("click", "a[rel='modal']", function(ev) {
         $("#action-modal-content").empty()
         $.ajax({
             url: $(this).attr("href"),
@@ -17,42 +17,165 @@ $(document).ready(function() {
         });
         ev.preventDefault();
     });
-    $(".alert[data-job-status]").each(function(i, flash) {
-        const job_url = flash.dataset.jobStatus;
-        const job_text = $(".job-text", flash).text();
+    $("[data-select-all]").on("change", function() {
+        $(this.form).find("input[type='checkbox'][name='" + this.dataset.selectAll + "']").prop("checked", this.checked);
+    });
+    $("form[data-newsoc-check]").each(function(i, form) {
+        // Check short and full names as they're typed, once the user pauses.
+        const timers = {};
+        const latest = {};
+        $("#society, #description", form).on("input", function() {
+            const field = this;
+            clearTimeout(timers[field.name]);
+            latest[field.name] = null;
+            if (!field.value.trim()) {
+                $(field).removeClass("is-invalid");
+                return;
+            }
+            timers[field.name] = setTimeout(function() {
+                const data = {};
+                data[field.name] = field.value.trim();
+                const req = latest[field.name] = $.ajax(form.dataset.newsocCheck, {data: data});
+                req.done(function(resp) {
+                    if (req !== latest[field.name]) {
+                        return;  // superseded by a later check
+                    }
+                    const error = resp.errors[field.name];
+                    $(field).toggleClass("is-invalid", !!error);
+                    $(field).siblings(".invalid-feedback").text(error || "");
+                });
+            }, 300);
+        });
+    });
+    $("[data-service-card]").each(function(i, card) {
+        const req = $.ajax(card.dataset.serviceCard);
+        req.done(function(resp) {
+            $(card).replaceWith(resp.html);
+        });
+        req.fail(function() {
+            $(".card-text", card).text("Sorry, we couldn't load this right now.  Try reloading the page.");
+        });
+    });
+    // Follow jobs on the page, calling watchers[id] with each new state of job `id` until
+    // it returns true.  While any job is queued or running, all of them share one
+    // connection: server-sent events where supported, or a long-polling loop otherwise.
+    // Jobs that won't move soon (e.g. awaiting approval) are just polled every 30s.
+    const watchers = {};
+    const activeStates = ["queued", "running"];
+    const idlePoll = 30000;
+    function watchJobs() {
+        const main = $("main")[0];
+        const states = {};
         let retry = 2;
-        function poll() {
-            const req = $.ajax(job_url);
-            req.done(function(job) {
+        function update(id, state) {
+            states[id] = state;
+            if (watchers[id] && watchers[id](state)) {
+                delete watchers[id];
+            }
+        }
+        function next() {
+            const ids = Object.keys(watchers);
+            if (!ids.length) {
+                return;
+            }
+            if (!ids.some(function(id) { return activeStates.includes(states[id]); })) {
+                setTimeout(function() { poll(false); }, idlePoll);
+            } else if (window.EventSource) {
+                stream();
+            } else {
+                poll(true);
+            }
+        }
+        function stream() {
+            const events = new EventSource(main.dataset.jobEvents + "?ids=" + Object.keys(watchers).join(","));
+            events.addEventListener("state", function(ev) {
+                const job = JSON.parse(ev.data);
+                update(String(job.job_id), job.state);
+                if (!Object.keys(watchers).length) {
+                    events.close();
+                }
+            });
+            events.addEventListener("idle", function() {
+                // Nothing's running any more, so stop the browser reconnecting.
+                events.close();
+                next();
+            });
+            events.addEventListener("error", function() {
+                if (events.readyState === EventSource.CLOSED) {
+                    // Refused outright (e.g. none of the jobs are visible) -- check back later.
+                    setTimeout(function() { poll(false); }, idlePoll);
+                }
+            });
+        }
+        function poll(wait) {
+            const ids = Object.keys(watchers);
+            if (!ids.length) {
+                return;
+            }
+            const data = {ids: ids.join(",")};
+            if (wait) {
+                // The server holds the request until one of the jobs leaves the state we pass.
+                data.wait = ids.map(function(id) { return states[id]; }).join(",");
+            }
+            const req = $.ajax(main.dataset.jobStatus, {data: data});
+            req.done(function(resp) {
                 retry = 2;
-                let delay = 2;
-                if (job.state === "done") {
-                    $(flash).removeClass("alert-primary").addClass("alert-success");
-                    $(".message", flash).text("has completed.  Reload to see any changes.");
-                    return;
-                } else if (job.state === "failed") {
-                    $(flash).removeClass("alert-primary").addClass("alert-danger");
-                    $(".message", flash).text("has failed to complete.  The sysadmins have been notified.");
-                    return;
-                } else if (job.state === "withdrawn") {
-                    $(flash).removeClass("alert-primary").addClass("alert-info");
-                    $(".message", flash).text("has been withdrawn.  No changes have been made.");
-                    return;
-                } else if (job.state === "unapproved") {
-                    $(flash).removeClass("alert-primary").addClass("alert-warning");
-                    $(".message", flash).text("is awaiting approval from the sysadmins.  This may not be immediate; watch your email inbox for updates.");
-                    delay = 30;
-                } else if (job.state === "running") {
-                    $(flash).removeClass("alert-warning").addClass("alert-primary");
-                    $(".message", flash).text("is currently runnning, and will be completed shortly.");
+                for (const id of ids) {
+                    const state = resp.jobs[id];
+                    if (state === undefined) {
+                        // Gone, or not ours to see.
+                        delete watchers[id];
+                    } else if (state !== states[id]) {
+                        update(id, state);
+                    }
                 }
-                setTimeout(poll, 1000 * delay);
+                next();
             });
-            req.fail(function() {
-                setTimeout(poll, 1000 * retry);
+            req.fail(function(jqXHR) {
+                if (jqXHR.status === 404) {
+                    return;  // none of the jobs are ours to see
+                }
+                setTimeout(function() { poll(false); }, 1000 * retry);
                 retry = Math.min(retry * 2, 30);
             });
         }
-        poll();
+        poll(false);
+    }
+    $(".alert[data-job-id]").each(function(i, flash) {
+        watchers[flash.dataset.jobId] = function(state) {
+            if (state === "done") {
+                $(flash).removeClass("alert-primary").addClass("alert-success");
+                $(".message", flash).text("has completed.  Reload to see any changes.");
+                return true;
+            } else if (state === "failed") {
+                $(flash).removeClass("alert-primary").addClass("alert-danger");
+                $(".message", flash).text("has failed to complete.  The sysadmins have been notified.");
+                return true;
+            } else if (state === "withdrawn") {
+                $(flash).removeClass("alert-primary").addClass("alert-info");
+                $(".message", flash).text("has been withdrawn.  No changes have been made.");
+                return true;
+            } else if (state === "unapproved") {
+                $(flash).removeClass("alert-primary").addClass("alert-warning");
+                $(".message", flash).text("is awaiting approval from the sysadmins.  This may not be immediate; watch your email inbox for updates.");
+            } else if (state === "running") {
+                $(flash).removeClass("alert-warning").addClass("alert-primary");
+                $(".message", flash).text("is currently runnning, and will be completed shortly.");
+            }
+            return false;
+        };
+    });
+    $("[data-job-watch]").each(function(i, el) {
+        // Reload the job page as soon as the job moves on from the state shown.
+        watchers[el.dataset.jobWatch] = function(state) {
+            if (state !== el.dataset.jobState) {
+                location.reload();
+                return true;
+            }
+            return false;
+        };
     });
+    if (Object.keys(watchers).length) {
+        watchJobs();
+    }
 });
@@ -1,21 +1,36 @@
-from datetime import datetime
+import csv
+from datetime import datetime, timedelta
+import enum
+import io
+import json
 import math
+import os
 
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask import Blueprint, flash, redirect, render_template, request, Response, stream_with_context, url_for
 from sqlalchemy import func as sql_func
-from werkzeug.exceptions import NotFound
+from werkzeug.exceptions import BadRequest, NotFound
 
 from srcf.controllib.jobs import Job, JobAction, JobActionInvalid, SocietyJob
 import srcf.database
 from srcf.database import JobLog
 
-from . import utils
+from . import inspect_services, job_events, job_queries, utils
 from .utils import srcf_db_sess as sess
 
 
 bp = Blueprint("admin", __name__)
 
 per_page = 25
+log_per_page = 200
+
+# Actions that can be applied to several jobs at once from the job queue, by state.
+bulk_actions = {
+    "unapproved": ("approve", "reject"),
+    "queued": ("cancel",),
+}
+
+# Most jobs a single bulk_set_state request may act on.
+max_bulk = 100
 
 
 @bp.before_request
@@ -23,14 +38,29 @@ def before_request():
     utils.auth_admin()
 
 
+# Job counts by state, kept until the job listener reports a change.
+_job_counts_cache = utils.TTLCache(1, float(os.getenv("JOB_COUNTS_TTL", "300")))
+job_events.listener.subscribe(lambda event: _job_counts_cache.clear())
+
+
 def job_counts():
+    job_events.listener.start()
+    counts = _job_counts_cache.get("counts")
+    if counts is not None:
+        return counts
+
+    generation = job_events.listener.generation
     job_row = srcf.database.Job
     q = (
         sess.query(job_row.state, sql_func.count(job_row.job_id))
         .group_by(job_row.state)
         .order_by(job_row.state)  # this is the order the enum was defined in, and is what we want.
     )
-    return q.all()
+    counts = q.all()
+    # Without a listener we won't hear about changes, so don't cache at all.
+    if job_events.listener.connected and job_events.listener.generation == generation:
+        _job_counts_cache.set("counts", counts)
+    return counts
 
 
 @bp.route('/admin')
@@ -45,32 +75,179 @@ def home():
 @bp.route('/admin/jobs/failed',     defaults={"state": "failed"})
 @bp.route('/admin/jobs/withdrawn',  defaults={"state": "withdrawn"})
 def view_jobs(state):
-
-    # Best-effort parsing of ?page= falling back to 1 in all error cases
-    page = 1
-    try:
-        page = int(request.args["page"])
-    except (KeyError, ValueError):
-        pass
+    args = utils.pagination_args()
 
     job_row = srcf.database.Job
-    jobs = (
-        sess.query(job_row)
-        .filter(job_row.state == state)
-        .order_by(job_row.job_id.desc())
-    )
-    jobs = [Job.of_row(r) for r in jobs]
-    max_pages = int(math.ceil(len(jobs) / float(per_page)))
-    jobs = jobs[min(len(jobs), per_page * (page - 1)):min(len(jobs), per_page * page)]
-    note_count = dict()
-    for j in jobs:
-        j.resolve_references(sess)
-        note_count[j.job_id] = (
-            sess.query(JobLog)
-            .filter(JobLog.job_id == j.job_id)
-            .filter(JobLog.type == 'note').count()
-        )
-    return render_template("admin/view_jobs.html", job_counts=job_counts(), state=state, jobs=jobs, note_count=note_count, pages=utils.Pagination(page, max_pages))
+    counts = job_counts()
+    total = dict(counts).get(state, 0)
+    max_pages = int(math.ceil(total / float(per_page)))
+    jobs = job_queries.find_page([job_row.state == state], args["page"], per_page,
+                                 before=args["before"], after=args["after"])
+    job_queries.resolve_references(jobs)
+    note_count = job_queries.note_counts([j.job_id for j in jobs])
+    pages = utils.Pagination(args["page"], max_pages,
+                             first_key=jobs[0].job_id if jobs else None,
+                             last_key=jobs[-1].job_id if jobs else None)
+    return render_template("admin/view_jobs.html", job_counts=counts, state=state, jobs=jobs, note_count=note_count, pages=pages,
+                           bulk_actions=bulk_actions.get(state, ()))
+
+
+# Roughly how much CSV (in characters) export_jobs sends at a time.
+export_chunk = 64 * 1024
+
+# Filters accepted by search_jobs, and the date ones among them.
+search_fields = ("owner", "society", "type", "state", "since", "until", "text")
+search_dates = ("since", "until")
+
+
+def _search_filters(strict=False):
+    """
+    Parse the search_jobs filters from the query string.  Returns the raw
+    values given (to fill the form and page links with), and the valid ones as
+    arguments for :func:`job_queries.search`.
+
+    Invalid values are skipped with a warning, or if `strict`, rejected with a
+    400 -- e.g. for exports, where there's no page to show the warning on.
+    """
+    params = {}
+    filters = {}
+    for key in search_fields:
+        value = request.args.get(key, "").strip()
+        if not value:
+            continue
+        params[key] = value
+        if key in search_dates:
+            try:
+                value = datetime.strptime(value, "%Y-%m-%d").date()
+            except ValueError:
+                if strict:
+                    raise BadRequest("Invalid date: {}".format(value))
+                flash("Ignoring invalid date: {}".format(value), "raw")
+                continue
+        filters[key] = value
+    if "state" in filters and filters["state"] not in (key for key, _ in job_counts()):
+        # Not a valid value for the enum, so don't send it to the database.
+        if strict:
+            raise BadRequest("Invalid state: {}".format(filters["state"]))
+        del filters["state"]
+    return params, filters
+
+
+@bp.route('/admin/jobs/search')
+def search_jobs():
+    params, filters = _search_filters()
+    counts = job_counts()
+    jobs = []
+    pages = None
+    if filters:
+        args = utils.pagination_args()
+        criteria = job_queries.search(**filters)
+        max_pages = int(math.ceil(job_queries.count(*criteria) / float(per_page)))
+        jobs = job_queries.find_page(criteria, args["page"], per_page,
+                                     before=args["before"], after=args["after"])
+        job_queries.resolve_references(jobs)
+        pages = utils.Pagination(args["page"], max_pages,
+                                 first_key=jobs[0].job_id if jobs else None,
+                                 last_key=jobs[-1].job_id if jobs else None,
+                                 params=params)
+    return render_template("admin/search.html", job_counts=counts, states=[key for key, _ in counts],
+                           params=params, searched=bool(filters), jobs=jobs, pages=pages)
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.name
+    return value
+
+
+@bp.route('/admin/jobs/export.<any(csv, ndjson):format>')
+def export_jobs(format):
+    """
+    Stream every job matching the search_jobs filters (all of them if none),
+    with ?logs=1 one row per log entry, as CSV or newline-delimited JSON.
+    """
+    params, filters = _search_filters(strict=True)
+    logs = request.args.get("logs", "0")
+    if logs not in ("0", "1"):
+        raise BadRequest("Invalid logs flag: {}".format(logs))
+    logs = logs == "1"
+    rows = job_queries.export(job_queries.search(**filters), logs=logs)
+
+    def stream_ndjson():
+        for row in rows:
+            yield json.dumps({key: _export_value(value) for key, value in row.items()}) + "\n"
+
+    def stream_csv():
+        buf = io.StringIO()
+        writer = None
+        for row in rows:
+            if not writer:
+                writer = csv.DictWriter(buf, fieldnames=list(row))
+                writer.writeheader()
+            # Mappings (the job's args) as JSON, rather than Python's repr.
+            writer.writerow({key: json.dumps(value) if isinstance(value, dict) else _export_value(value)
+                             for key, value in row.items()})
+            if buf.tell() >= export_chunk:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    name = "jobs-{}.{}".format(datetime.now().strftime("%Y%m%d-%H%M%S"), format)
+    if format == "csv":
+        body, mimetype = stream_csv(), "text/csv"
+    else:
+        body, mimetype = stream_ndjson(), "application/x-ndjson"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": "attachment; filename={}".format(name),
+                             "X-Accel-Buffering": "no"})
+
+
+# Windows offered by job_latency, in days (None for all time).
+latency_windows = (7, 30, 365, None)
+
+# Latency summaries, per window -- the view behind them only changes on refresh.
+_latency_cache = utils.TTLCache(len(latency_windows), float(os.getenv("JOB_LATENCY_TTL", "600")))
+
+
+@bp.route('/admin/jobs/latency')
+def job_latency():
+    days = request.args.get("days", "30")
+    # ?days=all for all time.
+    days = int(days) if days.isdigit() else None
+    if days not in latency_windows:
+        days = 30
+
+    cached = _latency_cache.get(days)
+    if cached is None:
+        if not job_queries.timings_available():
+            # Not cached, so the page picks the view up as soon as it's created.
+            return render_template("admin/latency.html", job_counts=job_counts(), summary=[], refreshed=None,
+                                   missing=True, days=days, windows=latency_windows,
+                                   percentiles=job_queries.LATENCY_PERCENTILES)
+        since = datetime.now() - timedelta(days=days) if days else None
+        cached = (job_queries.latency(since), job_queries.timings_refreshed())
+        _latency_cache.set(days, cached)
+    summary, refreshed = cached
+    return render_template("admin/latency.html", job_counts=job_counts(), summary=summary, refreshed=refreshed, missing=False,
+                           days=days, windows=latency_windows, percentiles=job_queries.LATENCY_PERCENTILES)
+
+
+@bp.route('/admin/stats')
+def worker_stats():
+    """Counters kept by this worker process's connection pools and caches."""
+    stats = [
+        ("MySQL connection pool", utils.mysql_pool.stats()),
+        ("Web root cache", inspect_services.webroot_stats()),
+        ("HTTP requests", inspect_services.http_stats()),
+    ]
+    # Format timings here: Jinja on focal (2.10) has no `float` test.
+    stats = [(title, {key: "{:.3f}".format(value) if isinstance(value, float) else value
+                      for key, value in values.items()})
+             for title, values in stats]
+    return render_template("admin/stats.html", job_counts=job_counts(), stats=stats, pid=os.getpid())
 
 
 @bp.route('/admin/jobs/<int:id>')
@@ -79,9 +256,9 @@ def status(id):
     if not job:
         raise NotFound(id)
 
-    log = list(sess.query(JobLog).filter(JobLog.job_id == id).order_by(JobLog.time))
-    has_create_log = sess.query(JobLog).filter(JobLog.job_id == id).filter(JobLog.type == 'created').first() is not None
-    notes = [x for x in log if x.type == "note"]
+    page = utils.pagination_args()["page"]
+    log, notes, total, has_create_log = job_queries.log_page(id, page, log_per_page)
+    log_pages = utils.Pagination(page, int(math.ceil(total / float(log_per_page))))
 
     job_home_url = url_for('admin.view_jobs', state=job.state)
     for_society = isinstance(job, SocietyJob)
@@ -90,11 +267,18 @@ def status(id):
     if for_society:
         owner_in_context = job.society_society
 
-    return render_template("admin/status.html", job=job, notes=notes, log=log, job_home_url=job_home_url,
+    return render_template("admin/status.html", job=job, notes=notes, log=log, log_pages=log_pages, job_home_url=job_home_url,
                            for_society=for_society, owner_in_context=owner_in_context,
                            principal=utils.effective_crsid(), has_create_log=has_create_log)
 
 
+def _state_change_log(action):
+    # The action's name goes in `raw`, so that sql/job_timings.sql can spot
+    # approvals without depending on the wording of the message.
+    return dict(type="progress", level="info", raw=action.name,
+                message="Admin state change: job {} by {} via web".format(action.past_label, utils.effective_crsid()))
+
+
 @bp.route('/admin/jobs/<int:id>/<action>')
 def set_state(id, action):
     try:
@@ -112,14 +296,60 @@ def set_state(id, action):
         flash("Sorry, this job cannot be transitioned now.", "raw")
         return redirect(url_for("admin.status", id=id))
 
-    sess.add(JobLog(job_id=id, type="progress", level="info", time=datetime.now(),
-                    message="Admin state change: job {} by {} via web"
-                            .format(action.past_label, utils.effective_crsid())))
+    sess.add(JobLog(job_id=id, time=datetime.now(), **_state_change_log(action)))
 
     target = request.referrer or url_for("admin.status", id=id)
     return redirect(target)
 
 
+@bp.route('/admin/jobs/bulk', methods=["POST"])
+def bulk_set_state():
+    try:
+        action = JobAction[request.form.get("action", "")]
+    except KeyError:
+        raise NotFound(request.form.get("action"))
+
+    ids = set()
+    for value in request.form.getlist("job"):
+        try:
+            ids.add(int(value))
+        except ValueError:
+            pass
+    target = request.referrer or url_for("admin.home")
+    if not ids:
+        flash("No jobs were selected.", "raw")
+        return redirect(target)
+    if len(ids) > max_bulk:
+        flash("Sorry, only {} jobs can be changed at once.".format(max_bulk), "raw")
+        return redirect(target)
+
+    # Lock the rows so the job runner can't pick them up mid-change; everything
+    # below commits (or rolls back) together at the end of the request.
+    jobs = job_queries.find_many(ids, lock=True)
+    job_queries.resolve_references(jobs)
+    now = datetime.now()
+    log = _state_change_log(action)
+    done = []
+    failed = ["#{} (not found)".format(id) for id in sorted(ids - {job.job_id for job in jobs})]
+    for job in jobs:
+        try:
+            job.transition(action)
+        except JobActionInvalid:
+            failed.append("#{} (currently {})".format(job.job_id, job.state))
+            continue
+        done.append(job.job_id)
+
+    if done:
+        sess.bulk_insert_mappings(JobLog, [
+            dict(job_id=id, time=now, **log)
+            for id in done
+        ])
+        flash("{} {} job{}.".format(action.past_label.capitalize(), len(done), "" if len(done) == 1 else "s"), "raw")
+    if failed:
+        flash("Sorry, these jobs cannot be transitioned now: {}.".format(", ".join(failed)), "raw")
+    return redirect(target)
+
+
 @bp.route('/admin/jobs/<int:job_id>/notes', methods=["POST"])
 def add_note(job_id):
     text = request.form.get("text", "").strip()
@@ -15,9 +15,7 @@ def home():
     elif not mem.user:
         return redirect(url_for('member.reactivate'))
 
-    inspect_services.lookup_all(mem, fast=True)
-    for soc in mem.societies:
-        inspect_services.lookup_all(soc, fast=True)
+    inspect_services.lookup_all_many([mem] + list(mem.societies), fast=True)
 
     job_counts = None
     if utils.is_admin(mem):
@@ -3,112 +3,485 @@ inspect_services: look up accounts, mailing lists, etc. that a User or
 Group has on the SRCF
 """
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import copy
+import logging
 import os
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from srcf.controllib.jobs import CreateSocietyMailingList, CreateUserMailingList, SocietyJob
 import srcf.database
-from srcf.database import queries
 
-from . import utils
+from . import job_events, utils
 from .utils import srcf_db_sess as sess
 
 
-def lookup_pgdbs(prefix):
-    """Return a list of PostgreSQL databases owned by `prefix` (a user or soc)"""
+LOG = logging.getLogger(__name__)
+
+# lookup_all runs its probes in parallel on a small per-worker thread pool.
+# Each probe gets its own connections, as the request-scoped session and
+# MySQL connection can't be shared across threads.
+PROBE_WORKERS = int(os.getenv("INSPECT_PROBE_WORKERS", "6"))
+PROBE_TIMEOUT = float(os.getenv("INSPECT_PROBE_TIMEOUT", "10"))
+
+_probe_pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="inspect")
+
+# A probe that times out can't actually be stopped, and keeps its pool thread
+# until it returns.  Postgres probes are bounded by a statement timeout, but a
+# hung MySQL server or filesystem isn't, so count the probes we've given up on
+# that are still running, and stop submitting more once they fill the pool.
+_abandoned = 0
+_abandoned_lock = threading.Lock()
+
+# The properties set by lookup_all for each service card on the dashboards.
+SERVICE_KINDS = {
+    "mysql": ("mysqluser", "mysqldbs"),
+    "postgres": ("pguser", "pgdbs"),
+    "website": ("website",),
+    "mailinglists": ("mailinglists",),
+}
+
+# Mailing lists only change through our own jobs, so we can afford to hold on
+# to them for a while and drop entries as soon as a relevant job is seen.
+MAILING_LIST_CACHE_TTL = float(os.getenv("MAILING_LIST_CACHE_TTL", "300"))
+MAILING_LIST_CACHE_SIZE = int(os.getenv("MAILING_LIST_CACHE_SIZE", "1024"))
+MAILING_LIST_JOBS = (CreateUserMailingList, CreateSocietyMailingList)
+
+_mailinglists_cache = utils.TTLCache(MAILING_LIST_CACHE_SIZE, MAILING_LIST_CACHE_TTL)
+
+# Whether a web root is empty can only change when its mtime does, so cache the
+# answer against that -- the TTL is just a backstop.
+WEBROOT_CACHE_TTL = float(os.getenv("WEBROOT_CACHE_TTL", "3600"))
+WEBROOT_CACHE_SIZE = int(os.getenv("WEBROOT_CACHE_SIZE", "4096"))
+
+_webroot_cache = utils.TTLCache(WEBROOT_CACHE_SIZE, WEBROOT_CACHE_TTL)
+_webroot_stats = {"hits": 0, "misses": 0}
+_webroot_stats_lock = threading.Lock()
+
+# Everything here that talks HTTP shares one keep-alive session, with bounded
+# timeouts (seconds) so that a hung backend can't pin a worker.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+
+# Where to find lists.srcf.net's list of lists -- overridable to point at a stand-in.
+LISTS_URL = os.getenv("LISTS_URL", "https://lists.srcf.net/getlists.cgi")
+
+# Optionally keep an index of every list in memory instead, rebuilt from a
+# single bulk fetch every MAILING_LIST_INDEX_REFRESH seconds.
+MAILING_LIST_INDEX = os.getenv("MAILING_LIST_INDEX", "") not in ("", "0")
+MAILING_LIST_INDEX_REFRESH = float(os.getenv("MAILING_LIST_INDEX_REFRESH", "300"))
+
+
+def _prefix(obj):
+    """The user or group account name that services of `obj` are named after."""
+    if isinstance(obj, srcf.database.Member):
+        return obj.crsid
+    elif isinstance(obj, srcf.database.Society):
+        return obj.society
+    else:
+        raise TypeError(obj)
+
+
+def lookup_pgdbs_many(prefixes, session=None):
+    """Map each of `prefixes` to a list of the PostgreSQL databases it owns"""
     # we can borrow the postgres connection we already have
-    q = sess.execute('SELECT datname FROM pg_database '
-                     'JOIN pg_user ON datdba = pg_user.usesysid '
-                     'WHERE usename = :prefix', {'prefix': prefix})
-    return [row[0] for row in q.fetchall()]
+    q = (session or sess).execute('SELECT usename, datname FROM pg_database '
+                                  'JOIN pg_user ON datdba = pg_user.usesysid '
+                                  'WHERE usename = ANY(:prefixes)', {'prefixes': list(prefixes)})
+    dbs = {prefix: [] for prefix in prefixes}
+    for owner, name in q.fetchall():
+        dbs[owner].append(name)
+    return dbs
 
 
-def lookup_mysqldbs(prefix):
-    """Return a list of MySQL databases owned by `prefix` (a user or soc)"""
-    cur = utils.temp_mysql_conn().cursor()
+def lookup_pgdbs(prefix, session=None):
+    """Return a list of PostgreSQL databases owned by `prefix` (a user or soc)"""
+    return lookup_pgdbs_many([prefix], session)[prefix]
+
+
+def lookup_mysqldbs_many(prefixes, conn=None):
+    """Map each of `prefixes` to a list of the MySQL databases it owns"""
+    names = {prefix: prefix.replace("-", "_") for prefix in prefixes}
+    dbs = {prefix: [] for prefix in prefixes}
+    if not names:
+        return dbs
+    cur = (conn or utils.temp_mysql_conn()).cursor()
     try:
-        prefix = prefix.replace("-", "_")
-        q = "SELECT SCHEMA_NAME FROM information_schema.schemata WHERE " \
-            "SCHEMA_NAME = %s OR SCHEMA_NAME LIKE %s"
-        cur.execute(q, (prefix, prefix + '/%'))
-        return [row[0] for row in cur]
+        clauses = []
+        params = []
+        for name in names.values():
+            clauses.append("SCHEMA_NAME = %s OR SCHEMA_NAME LIKE %s")
+            params += [name, name + '/%']
+        q = "SELECT SCHEMA_NAME FROM information_schema.schemata WHERE " + " OR ".join(clauses)
+        cur.execute(q, params)
+        schemas = [row[0] for row in cur]
     finally:
         cur.close()
+    for prefix, name in names.items():
+        dbs[prefix] = [schema for schema in schemas
+                       if schema == name or schema.startswith(name + '/')]
+    return dbs
 
 
-def lookup_pguser(prefix):
+def lookup_mysqldbs(prefix, conn=None):
+    """Return a list of MySQL databases owned by `prefix` (a user or soc)"""
+    return lookup_mysqldbs_many([prefix], conn)[prefix]
+
+
+def lookup_pgusers(prefixes, session=None):
+    """Map each of `prefixes` to itself if it's a PostgreSQL user, else None"""
+    q = (session or sess).execute('SELECT rolname FROM pg_roles WHERE rolname = ANY(:users) AND rolcanlogin',
+                                  {"users": list(prefixes)})
+    found = {row[0] for row in q.fetchall()}
+    return {prefix: prefix if prefix in found else None for prefix in prefixes}
+
+
+def lookup_pguser(prefix, session=None):
     """Does this PostgreSQL user exist?"""
-    q = sess.execute('SELECT rolname FROM pg_roles WHERE rolname = :user AND rolcanlogin',
-                     {"user": prefix})
-    assert q.rowcount in {0, 1}
-    q.fetchall()
-    if q.rowcount:
-        return prefix
-    else:
-        return None
+    return lookup_pgusers([prefix], session)[prefix]
 
 
-def lookup_mysqluser(prefix):
-    """Does this MySQL user exist?"""
-    cur = utils.temp_mysql_conn().cursor()
+def lookup_mysqlusers(prefixes, conn=None):
+    """Map each of `prefixes` to its MySQL username if that user exists, else None"""
+    names = {prefix: prefix.replace("-", "_") for prefix in prefixes}
+    if not names:
+        return {}
+    cur = (conn or utils.temp_mysql_conn()).cursor()
     try:
-        prefix = prefix.replace("-", "_")
-        q = "SELECT User from mysql.user WHERE User = %s"
-        cur.execute(q, (prefix, ))
-        assert cur.rowcount in {0, 1}
-        if cur.rowcount:
-            return prefix
-        else:
-            return None
+        q = "SELECT User from mysql.user WHERE User IN ({})".format(", ".join(["%s"] * len(names)))
+        cur.execute(q, list(names.values()))
+        found = {row[0] for row in cur}
     finally:
         cur.close()
+    return {prefix: name if name in found else None for prefix, name in names.items()}
 
 
-def lookup_mailinglists(prefix):
-    """Find all mailing lists owned by `prefix`"""
-    req = requests.get("https://lists.srcf.net/getlists.cgi", params={'prefix': prefix})
+def lookup_mysqluser(prefix, conn=None):
+    """Does this MySQL user exist?"""
+    return lookup_mysqlusers([prefix], conn)[prefix]
+
+
+def _http_session():
+    session = requests.Session()
+    # Retry failed connections and gateway errors, but never a read that timed
+    # out -- that would multiply HTTP_READ_TIMEOUT, and some calls run on the
+    # request thread.
+    retry = Retry(total=HTTP_RETRIES, read=0, backoff_factor=0.2, status_forcelist=(502, 503, 504))
+    # One pooled connection per probe thread, plus one for the request thread.
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=PROBE_WORKERS + 1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+_http = _http_session()
+_http_stats = {"requests": 0, "errors": 0, "seconds": 0.0}
+_http_stats_lock = threading.Lock()
+
+
+def http_get(url, **kwargs):
+    """
+    GET `url` using the shared pooled session, with default timeouts, and
+    record the request in :func:`http_stats`.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    start = time.monotonic()
+    failed = True
+    try:
+        resp = _http.get(url, **kwargs)
+        failed = False
+        return resp
+    finally:
+        elapsed = time.monotonic() - start
+        with _http_stats_lock:
+            _http_stats["requests"] += 1
+            _http_stats["errors"] += failed
+            _http_stats["seconds"] += elapsed
+        LOG.debug("GET %s took %.3fs%s", url, elapsed, " (failed)" if failed else "")
+
+
+def http_stats():
+    """Return a snapshot of the request count, error count and total time spent on HTTP."""
+    with _http_stats_lock:
+        return dict(_http_stats)
+
+
+def _fetch_mailinglists(prefix=None):
+    """Ask the lists host for every list, or just those owned by `prefix`."""
+    params = {'prefix': prefix} if prefix is not None else {}
+    req = http_get(LISTS_URL, params=params)
     req.raise_for_status()
     assert req.headers['content-type'].split(';')[0] == 'text/plain'
     return [listname for listname in req.text.split("\n") if listname]
 
 
-def lookup_website(prefix, is_member):
-    """Detect if a website exists for the given user."""
-    path = os.path.join("/public", "home" if is_member else "societies", prefix, "public_html")
-    web = {"vhosts": list(sess.query(srcf.database.Domain).filter(srcf.database.Domain.owner == prefix)), "state": None}
-    if web["vhosts"]:
-        domains = []
-        for domain in web["vhosts"]:
-            domains += [domain.domain, "www.{}".format(domain.domain)]
+class MailingListIndex(object):
+    """
+    An index of every mailing list on the lists host, built from one bulk fetch.
+
+    Once the index is older than `refresh` seconds, or after `invalidate_all`,
+    lookups keep answering from it while a background thread rebuilds it.
+    Prefixes invalidated in the meantime are fetched individually and patched in.
+    """
+
+    def __init__(self, refresh):
+        self.refresh = refresh
+        self._by_prefix = {}
+        self._built = None
+        self._expired = None
+        self._dirty = {}
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prefixes(listname):
+        # Owners may themselves contain hyphens, so file each list under every
+        # candidate prefix -- the lists host matches on prefix the same way.
+        parts = listname.split("-")
+        return ("-".join(parts[:i]) for i in range(1, len(parts)))
+
+    def _rebuild(self):
+        started = time.monotonic()
+        try:
+            names = _fetch_mailinglists()
+        except Exception:
+            LOG.exception("Failed to rebuild mailing list index")
+            with self._lock:
+                self._refreshing = False
+            return
+        by_prefix = {}
+        for name in names:
+            for prefix in self._prefixes(name):
+                by_prefix.setdefault(prefix, set()).add(name)
+        with self._lock:
+            self._by_prefix = by_prefix
+            self._built = started
+            self._dirty = {prefix: when for prefix, when in self._dirty.items() if when >= started}
+            self._refreshing = False
+
+    def _patch(self, prefix):
+        started = time.monotonic()
+        names = set(_fetch_mailinglists(prefix))
+        with self._lock:
+            self._by_prefix[prefix] = names
+            if self._dirty.get(prefix, started) < started:
+                del self._dirty[prefix]
+
+    def _ensure(self, prefix):
+        with self._lock:
+            missing = self._built is None
+            stale = not missing and (time.monotonic() - self._built > self.refresh
+                                     or (self._expired is not None and self._expired >= self._built))
+            dirty = prefix in self._dirty
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._rebuild, name="mailinglist-index", daemon=True).start()
+        if missing:
+            self._rebuild()
+            if self._built is None:
+                raise RuntimeError("Mailing list index unavailable")
+        elif dirty:
+            self._patch(prefix)
+
+    def lists(self, prefix):
+        self._ensure(prefix)
+        with self._lock:
+            return sorted(self._by_prefix.get(prefix, ()))
+
+    def exists(self, prefix, listname):
+        self._ensure(prefix)
+        with self._lock:
+            return listname in self._by_prefix.get(prefix, ())
+
+    def invalidate(self, prefix):
+        with self._lock:
+            self._dirty[prefix] = time.monotonic()
+
+    def invalidate_all(self):
+        with self._lock:
+            self._expired = time.monotonic()
+
+
+_mailinglist_index = MailingListIndex(MAILING_LIST_INDEX_REFRESH) if MAILING_LIST_INDEX else None
+
+
+def lookup_mailinglists(prefix):
+    """Find all mailing lists owned by `prefix`"""
+    # Needed for on_job_event to hear about finished jobs.
+    job_events.listener.start()
+    if _mailinglist_index:
+        return _mailinglist_index.lists(prefix)
+    lists = _mailinglists_cache.get(prefix)
+    if lists is None:
+        # If a job finishes mid-fetch, what we fetched may predate it: don't keep it.
+        generation = _mailinglists_cache.generation
+        lists = _fetch_mailinglists(prefix)
+        _mailinglists_cache.set(prefix, lists, generation)
+    return list(lists)
+
+
+def mailinglist_exists(prefix, listname):
+    """Is there a mailing list called `listname` owned by `prefix`?"""
+    job_events.listener.start()
+    if _mailinglist_index:
+        return _mailinglist_index.exists(prefix, listname)
+    return listname in lookup_mailinglists(prefix)
+
+
+def invalidate_mailinglists(prefix):
+    """Forget any cached mailing lists for `prefix` in this worker."""
+    _mailinglists_cache.invalidate(prefix)
+    if _mailinglist_index:
+        _mailinglist_index.invalidate(prefix)
+
+
+def invalidate_for_job(job):
+    """
+    Drop any cached lookups that `job` (a :cls:`srcf.controllib.jobs.Job`)
+    may make stale, e.g. when it's submitted or seen to have finished.
+    """
+    if isinstance(job, MAILING_LIST_JOBS):
+        if isinstance(job, SocietyJob):
+            invalidate_mailinglists(job.society_society)
+        else:
+            invalidate_mailinglists(job.owner_crsid)
+
+
+def on_job_event(event):
+    """
+    Job listener callback: drop cached mailing lists for the owner of any
+    mailing list job that finishes, in whichever worker sees it.  If the
+    listener lost its connection (`event` is None), we may have missed some,
+    so drop all of them, and have the index (if any) rebuilt.
+    """
+    if event is None:
+        _mailinglists_cache.clear()
+        if _mailinglist_index:
+            _mailinglist_index.invalidate_all()
+        return
+    if event.get("state") in ("done", "failed") and event.get("type") in _mailing_list_job_types:
+        prefix = event.get("society") or event.get("owner")
+        if prefix:
+            invalidate_mailinglists(prefix)
+
+
+# The type column holds each job class's JOB_TYPE, not its class name.
+_mailing_list_job_types = tuple(cls.JOB_TYPE for cls in MAILING_LIST_JOBS)
+job_events.listener.subscribe(on_job_event)
+
+
+def _lookup_mailinglists_many(prefixes):
+    return {prefix: lookup_mailinglists(prefix) for prefix in prefixes}
+
+
+def lookup_websites(owners, session=None):
+    """
+    Look up the websites of `owners`, a list of Member or Society objects.  The
+    result maps each of their prefixes to a website dict.
+    """
+    return _lookup_websites(_website_owners(owners), session)
+
+
+def _website_owners(owners):
+    # Read everything we need off the ORM objects up front, so that the lookup
+    # itself can run on a thread without touching the request's session.
+    return [(_prefix(owner), isinstance(owner, srcf.database.Member), owner.ucam_redirect)
+            for owner in owners]
+
+
+def _lookup_websites(owners, session=None):
+    session = session or sess
+    sites = {prefix: {"vhosts": [], "certs": [], "state": None} for prefix, _, _ in owners}
+    if not sites:
+        return sites
+
+    vhosts = session.query(srcf.database.Domain).filter(srcf.database.Domain.owner.in_(list(sites)))
+    domains = []
+    for domain in vhosts:
+        sites[domain.owner]["vhosts"].append(domain)
+        domains += [domain.domain, "www.{}".format(domain.domain)]
+    certs = set()
+    if domains:
         cert_records = (
-            sess.query(srcf.database.HTTPSCert.domain)
+            session.query(srcf.database.HTTPSCert.domain)
             .filter(srcf.database.HTTPSCert.domain.in_(domains))
             .filter(srcf.database.HTTPSCert.provisioned)
         )
-        certs = set()
         for record in cert_records:
             name = record[0]
             while name.startswith("www."):
                 name = name[4:]
             certs.add(name)
-        web["certs"] = list(certs)
-    else:
-        web["certs"] = []
+
+    for prefix, is_member, ucam_redirect in owners:
+        web = sites[prefix]
+        web["certs"] = [domain.domain for domain in web["vhosts"] if domain.domain in certs]
+        web["exists"] = _webroot_exists(prefix, is_member)
+        if web["exists"]:
+            web["state"] = "legacyredirect" if ucam_redirect else "subdomain"
+    return sites
+
+
+def _webroot_exists(prefix, is_member):
+    path = os.path.join("/public", "home" if is_member else "societies", prefix, "public_html")
     try:
-        web["exists"] = os.path.exists(path) and len(os.listdir(path)) > 0
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return False
+    cached = _webroot_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        with _webroot_stats_lock:
+            _webroot_stats["hits"] += 1
+        return cached[1]
+    with _webroot_stats_lock:
+        _webroot_stats["misses"] += 1
+    try:
+        # Stop at the first entry rather than listing the whole directory.
+        with os.scandir(path) as entries:
+            exists = next(entries, None) is not None
     except OSError:
         # May exist, but we can't read it -- assume active as users may have hidden the contents.
-        web["exists"] = True
-    if web["exists"]:
-        owner = queries.get_member_or_society(prefix)
-        web["state"] = "legacyredirect" if owner.ucam_redirect else "subdomain"
-    return web
+        exists = True
+    _webroot_cache.set(path, (mtime, exists))
+    return exists
+
 
+def webroot_stats():
+    """Return a snapshot of the web root cache's hit and miss counts."""
+    with _webroot_stats_lock:
+        return dict(_webroot_stats)
 
-def lookup_all(obj, fast=False):
+
+def _probe(lookup, *args, postgres=False, mysql=False):
     """
-    Augment `obj` (a :cls:`srcf.database.Member` or
-    :cls:`srcf.database.Society`) with several properties
+    Run `lookup` on the current (worker) thread, passing it private
+    connections for whichever backends it needs.
+    """
+    kwargs = {}
+    try:
+        if postgres:
+            kwargs["session"] = srcf.database.Session()
+            kwargs["session"].execute("SET LOCAL statement_timeout = {:d}".format(int(PROBE_TIMEOUT * 1000)))
+        if mysql:
+            kwargs["conn"] = utils.mysql_pool.acquire()
+        return lookup(*args, **kwargs)
+    finally:
+        if "session" in kwargs:
+            kwargs["session"].close()
+        if "conn" in kwargs:
+            utils.mysql_pool.release(kwargs["conn"])
+
+
+def lookup_all_many(objs, fast=False, only=None):
+    """
+    Augment each of `objs` (:cls:`srcf.database.Member` or
+    :cls:`srcf.database.Society` objects) with several properties
 
     * mysqluser : string | None
     * mysqldbs : string list
@@ -116,22 +489,92 @@ def lookup_all(obj, fast=False):
     * pgdbs : string list
     * mailinglists : string list
     * website: {exists: bool[, state: str]}
+    * unavailable : set of SERVICE_KINDS keys that couldn't be checked
 
     If fast==True, omit properties which are slow to
     retrieve -- currently just mailinglists
+
+    If `only` is given, look up just the named properties (see SERVICE_KINDS).
+
+    Each backend is queried once for all of `objs` together.  The lookups are
+    independent, so they run concurrently; any probe that fails, or is still
+    outstanding after `PROBE_TIMEOUT` seconds, is abandoned.  Its property is
+    left at an empty default, and its service kind added to `unavailable` so
+    that templates don't mistake it for the service not existing.
     """
-    if isinstance(obj, srcf.database.Member):
-        prefix = obj.crsid
-    elif isinstance(obj, srcf.database.Society):
-        prefix = obj.society
+    global _abandoned
+    objs = list(objs)
+    prefixes = [_prefix(obj) for obj in objs]
+
+    # (attribute, default, lookup, args, backends)
+    probes = [
+        ("mysqluser", None, lookup_mysqlusers, (prefixes,), {"mysql": True}),
+        ("mysqldbs", [], lookup_mysqldbs_many, (prefixes,), {"mysql": True}),
+        ("pguser", None, lookup_pgusers, (prefixes,), {"postgres": True}),
+        ("pgdbs", [], lookup_pgdbs_many, (prefixes,), {"postgres": True}),
+        ("website", {"vhosts": [], "certs": [], "exists": False, "state": None},
+         _lookup_websites, (_website_owners(objs),), {"postgres": True}),
+    ]
+    if only is not None:
+        probes = [probe for probe in probes if probe[0] in only]
+    if not fast and (only is None or "mailinglists" in only):
+        # The lists host only answers for one prefix at a time.
+        for prefix in prefixes:
+            probes.append(("mailinglists", [], _lookup_mailinglists_many, ([prefix],), {}))
+
+    def finished(future):
+        global _abandoned
+        with _abandoned_lock:
+            _abandoned -= 1
+
+    with _abandoned_lock:
+        saturated = _abandoned >= PROBE_WORKERS
+    if saturated:
+        LOG.warning("Probe pool is full of hung lookups, skipping lookups for %s", ", ".join(prefixes))
+        futures = [None] * len(probes)
     else:
-        raise TypeError(obj)
+        futures = [_probe_pool.submit(_probe, lookup, *args, **backends)
+                   for _, _, lookup, args, backends in probes]
+    deadline = time.monotonic() + PROBE_TIMEOUT
+    results = {}
+    failed = {}
+    for (attr, _, _, args, _), future in zip(probes, futures):
+        results.setdefault(attr, {})
+        # Mailing lists are probed one prefix at a time, everything else all at once.
+        covers = args[0] if attr == "mailinglists" else prefixes
+        try:
+            if future is None:
+                raise TimeoutError
+            results[attr].update(future.result(timeout=max(0, deadline - time.monotonic())))
+        except TimeoutError:
+            LOG.warning("Timed out looking up %s for %s", attr, ", ".join(covers))
+            if future is not None and not future.cancel():
+                with _abandoned_lock:
+                    _abandoned += 1
+                future.add_done_callback(finished)
+            failed.setdefault(attr, []).extend(covers)
+        except Exception:
+            LOG.exception("Failed looking up %s for %s", attr, ", ".join(covers))
+            failed.setdefault(attr, []).extend(covers)
+
+    kinds = {attr: kind for kind, attrs in SERVICE_KINDS.items() for attr in attrs}
+    for obj, prefix in zip(objs, prefixes):
+        unavailable = getattr(obj, "unavailable", set())
+        unavailable.difference_update(kinds[attr] for attr, _, _, _, _ in probes)
+        for attr, default, _, _, _ in probes:
+            if prefix in results[attr]:
+                setattr(obj, attr, results[attr][prefix])
+            else:
+                setattr(obj, attr, copy.deepcopy(default))
+            if prefix in failed.get(attr, ()):
+                unavailable.add(kinds[attr])
+        obj.unavailable = unavailable
 
-    obj.mysqluser = lookup_mysqluser(prefix)
-    obj.mysqldbs = lookup_mysqldbs(prefix)
-    obj.pguser = lookup_pguser(prefix)
-    obj.pgdbs = lookup_pgdbs(prefix)
-    obj.website = lookup_website(prefix, isinstance(obj, srcf.database.Member))
 
-    if not fast:
-        obj.mailinglists = lookup_mailinglists(prefix)
+def lookup_all(obj, fast=False, only=None):
+    """
+    Augment `obj` (a :cls:`srcf.database.Member` or
+    :cls:`srcf.database.Society`) with the properties described in
+    :func:`lookup_all_many`.
+    """
+    lookup_all_many([obj], fast, only)
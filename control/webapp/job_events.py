@@ -0,0 +1,160 @@
+"""
+job_events: follow job state changes as Postgres announces them, via a single
+LISTEN connection per worker process
+"""
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+
+import srcf.database
+
+
+LOG = logging.getLogger(__name__)
+
+# How often to check on watched jobs while the listener isn't connected.
+POLL_INTERVAL = 3
+
+# Must match the trigger and channel installed by sql/job_notify.sql.
+TRIGGER = "control_notify_job_state"
+CHANNEL = "control_job_state"
+
+
+class JobListener(object):
+    """
+    A background thread that LISTENs for job state notifications and passes
+    them on to subscribers.
+
+    Subscribers are called on the listener thread, so should be quick.  They
+    receive the decoded notification payload (a dict with `job_id`, `state`,
+    `type`, `owner` and `society`), or None after (re)connecting, when any
+    number of notifications may have been missed.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.connected = False
+        # Bumped on every dispatch, so callers can tell if anything changed
+        # while they were busy.
+        self.generation = 0
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        """Start listening, if not already doing so in this process."""
+        with self._lock:
+            # Threads don't survive a fork, so check we started this one ourselves.
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.connected = False
+            self._thread = threading.Thread(target=self._run, name="job-listener", daemon=True)
+            self._thread.start()
+
+    def _dispatch(self, event):
+        with self._lock:
+            self.generation += 1
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                LOG.exception("Job event subscriber failed")
+
+    def _connect(self):
+        session = srcf.database.Session()
+        try:
+            pooled = session.get_bind().raw_connection()
+        finally:
+            session.close()
+        # This connection is ours for good, so take it out of the pool.
+        pooled.detach()
+        conn = pooled.connection
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            # Listening is pointless if nothing will ever notify us.
+            cur.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s", (TRIGGER,))
+            if not cur.fetchone():
+                conn.close()
+                return None
+            cur.execute("LISTEN {}".format(self.channel))
+        return conn
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                if conn is None:
+                    LOG.warning("Job notification trigger %s not installed, not listening", TRIGGER)
+                    time.sleep(300)
+                    continue
+                self.connected = True
+                self._dispatch(None)
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(json.loads(notify.payload))
+            except Exception:
+                LOG.exception("Lost job notification listener, reconnecting")
+            self.connected = False
+            self._dispatch(None)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(5)
+
+
+listener = JobListener(CHANNEL)
+
+
+class JobWatch(object):
+    """
+    Context manager that lets a request thread sleep until one of `job_ids`
+    might have changed state.
+
+    If the listener isn't connected, waits are cut short to POLL_INTERVAL, so
+    callers fall back to polling the database.
+    """
+
+    def __init__(self, job_ids):
+        self.job_ids = set(job_ids)
+        self._event = threading.Event()
+
+    def _notify(self, event):
+        if event is None or event.get("job_id") in self.job_ids:
+            self._event.set()
+
+    def __enter__(self):
+        listener.start()
+        listener.subscribe(self._notify)
+        return self
+
+    def __exit__(self, *exc):
+        listener.unsubscribe(self._notify)
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds; return True if woken by a notification."""
+        if not listener.connected:
+            timeout = min(timeout, POLL_INTERVAL)
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
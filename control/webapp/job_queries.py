@@ -0,0 +1,343 @@
+"""
+job_queries: look up pages and summaries of the job history in SQL, rather
+than loading every job into Python
+"""
+
+from datetime import timedelta
+
+from sqlalchemy import column, func as sql_func, literal_column, or_, table
+from sqlalchemy.orm import aliased
+
+from srcf.controllib.jobs import Job, SocietyJob
+import srcf.database
+from srcf.database import JobLog, Member, Society
+
+from .utils import srcf_db_sess as sess
+
+
+def owned_by(crsid):
+    """Criterion for jobs submitted by `crsid`."""
+    return srcf.database.Job.owner_crsid == crsid
+
+
+def for_society(name):
+    """Criterion for jobs acting on the group account `name`."""
+    return srcf.database.Job.args["society"] == name
+
+
+def pending(criterion):
+    """
+    Fetch the jobs matching `criterion` (e.g. :func:`owned_by`) that are still
+    awaiting approval, oldest first, as :cls:`srcf.controllib.jobs.Job` objects.
+    """
+    job_row = srcf.database.Job
+    q = sess.query(job_row).filter(criterion).filter(job_row.state == "unapproved").order_by(job_row.job_id)
+    return [Job.of_row(r) for r in q]
+
+
+# Text search configuration for job logs -- must match the index in sql/job_search.sql.
+LOG_SEARCH_CONFIG = literal_column("'english'::regconfig")
+
+
+def log_document():
+    """The text search document of a log entry, its message and raw output together."""
+    return sql_func.to_tsvector(LOG_SEARCH_CONFIG,
+                                sql_func.coalesce(JobLog.message, "") + " " + sql_func.coalesce(JobLog.raw, ""))
+
+
+def search(owner=None, society=None, type=None, state=None, since=None, until=None, text=None):
+    """
+    Criteria for an admin job search, skipping any filters not given.  `since`
+    and `until` are inclusive dates of creation; `text` is matched (as words,
+    with stemming) against the job's log entries.
+    """
+    job_row = srcf.database.Job
+    criteria = []
+    if owner:
+        criteria.append(owned_by(owner))
+    if society:
+        criteria.append(for_society(society))
+    if type:
+        criteria.append(job_row.type == type)
+    if state:
+        criteria.append(job_row.state == state)
+    if since:
+        criteria.append(job_row.created_at >= since)
+    if until:
+        criteria.append(job_row.created_at < until + timedelta(days=1))
+    if text:
+        logs = (
+            sess.query(JobLog.log_id)
+            .filter(JobLog.job_id == job_row.job_id)
+            .filter(log_document().op("@@")(sql_func.plainto_tsquery(LOG_SEARCH_CONFIG, text)))
+            .correlate(job_row)
+        )
+        criteria.append(logs.exists())
+    return criteria
+
+
+def count(*criteria):
+    """Count the jobs matching all of `criteria`."""
+    job_row = srcf.database.Job
+    return sess.query(sql_func.count(job_row.job_id)).filter(*criteria).scalar()
+
+
+def states_of(job_ids):
+    """Map each of `job_ids` that exists to just its state."""
+    job_row = srcf.database.Job
+    if not job_ids:
+        return {}
+    q = sess.query(job_row.job_id, job_row.state).filter(job_row.job_id.in_(list(job_ids)))
+    return dict(q)
+
+
+def statuses_of(job_ids):
+    """
+    Fetch just the columns needed to report on each of `job_ids`: its
+    `job_id`, `state`, `owner_crsid`, `society` and the time of its latest log
+    entry (`last_log`).  Returns a dict keyed by job ID, omitting missing jobs.
+    """
+    job_row = srcf.database.Job
+    if not job_ids:
+        return {}
+    last_log = (
+        sess.query(sql_func.max(JobLog.time))
+        .filter(JobLog.job_id == job_row.job_id)
+        .correlate(job_row)
+        .as_scalar()
+    )
+    q = (
+        sess.query(job_row.job_id, job_row.state, job_row.owner_crsid,
+                   job_row.args["society"].label("society"), last_log.label("last_log"))
+        .filter(job_row.job_id.in_(list(job_ids)))
+    )
+    return {row.job_id: row for row in q}
+
+
+def status_of(job_id):
+    """Single-job form of :func:`statuses_of`, returning None if there's no such job."""
+    return statuses_of([job_id]).get(job_id)
+
+
+def visible_ids(statuses, crsid):
+    """
+    Return the IDs of those jobs (given as :func:`statuses_of` rows) that
+    `crsid` may see: they must own it, or administer the group account it
+    acts on.
+    """
+    visible = {status.job_id for status in statuses if status.owner_crsid == crsid}
+    names = {status.society for status in statuses if status.job_id not in visible and status.society}
+    if names:
+        q = (
+            sess.query(Society.society)
+            .filter(Society.society.in_(list(names)))
+            .filter(Society.admins.any(Member.crsid == crsid))
+        )
+        admin_of = {row[0] for row in q}
+        visible.update(status.job_id for status in statuses if status.society in admin_of)
+    return visible
+
+
+def find_page(criteria, page, per_page, before=None, after=None):
+    """
+    Fetch one page of the jobs matching all of `criteria`, newest first.
+
+    Stepping between adjacent pages can pass the ID of the last job shown as
+    `before`, or of the first job shown as `after`, to seek with the primary
+    key instead of skipping over earlier pages with OFFSET.
+
+    Returns a list of :cls:`srcf.controllib.jobs.Job` objects.
+    """
+    job_row = srcf.database.Job
+    q = sess.query(job_row).filter(*criteria)
+    if before is not None:
+        rows = q.filter(job_row.job_id < before).order_by(job_row.job_id.desc()).limit(per_page).all()
+    elif after is not None:
+        rows = q.filter(job_row.job_id > after).order_by(job_row.job_id.asc()).limit(per_page).all()
+        rows.reverse()
+    else:
+        rows = (q.order_by(job_row.job_id.desc())
+                .offset(per_page * max(page - 1, 0))
+                .limit(per_page).all())
+    return [Job.of_row(r) for r in rows]
+
+
+def find_many(job_ids, lock=False):
+    """
+    Fetch the jobs with the given IDs in one query, as a list of
+    :cls:`srcf.controllib.jobs.Job` objects in ID order.  With `lock`, the rows
+    are held with ``SELECT ... FOR UPDATE`` until the transaction ends.
+    """
+    job_row = srcf.database.Job
+    if not job_ids:
+        return []
+    q = sess.query(job_row).filter(job_row.job_id.in_(list(job_ids))).order_by(job_row.job_id)
+    if lock:
+        q = q.with_for_update()
+    return [Job.of_row(r) for r in q]
+
+
+def note_counts(job_ids):
+    """Map each of `job_ids` to the number of admin notes logged against it."""
+    counts = dict.fromkeys(job_ids, 0)
+    if counts:
+        q = (
+            sess.query(JobLog.job_id, sql_func.count(JobLog.log_id))
+            .filter(JobLog.job_id.in_(list(counts)))
+            .filter(JobLog.type == 'note')
+            .group_by(JobLog.job_id)
+        )
+        counts.update(q)
+    return counts
+
+
+def log_page(job_id, page, per_page):
+    """
+    Fetch one page of job `job_id`'s log, in order, along with all of its
+    notes, in a single query.
+
+    Returns a tuple of the page's entries, a list of ``(note, page)`` pairs
+    giving the log page each note appears on, the total number of entries, and
+    whether any of them is a `created` entry.
+    """
+    window = (
+        sess.query(JobLog,
+                   sql_func.row_number().over(order_by=(JobLog.time, JobLog.log_id)).label("n"),
+                   sql_func.count().over().label("total"),
+                   sql_func.bool_or(JobLog.type == "created").over().label("has_create_log"))
+        .filter(JobLog.job_id == job_id)
+        .subquery()
+    )
+    entry = aliased(JobLog, window)
+    first = per_page * max(page - 1, 0) + 1
+    q = (
+        sess.query(entry, window.c.n, window.c.total, window.c.has_create_log)
+        .filter(or_(window.c.n.between(first, first + per_page - 1), entry.type == "note"))
+        .order_by(window.c.n)
+    )
+    log = []
+    notes = []
+    total = 0
+    has_create_log = False
+    for row, n, total, has_create_log in q:
+        if first <= n < first + per_page:
+            log.append(row)
+        if row.type == "note":
+            notes.append((row, (n - 1) // per_page + 1))
+    return log, notes, total, has_create_log
+
+
+def export(criteria, logs=False, batch=1000):
+    """
+    Generate a dict for each job matching all of `criteria`, in ID order, or
+    with `logs` one for each of their log entries (with the job's fields
+    alongside).  Rows are fetched through a server-side cursor `batch` at a
+    time, so memory use doesn't grow with the size of the history.
+    """
+    job_row = srcf.database.Job
+    columns = [job_row.job_id, job_row.type, job_row.state, job_row.state_message, job_row.owner_crsid,
+               job_row.args["society"].label("society"), job_row.environment, job_row.created_at, job_row.args]
+    order = [job_row.job_id]
+    if logs:
+        columns += [JobLog.log_id, JobLog.time, JobLog.type.label("log_type"), JobLog.level,
+                    JobLog.message, JobLog.raw]
+        order += [JobLog.time, JobLog.log_id]
+    q = sess.query(*columns)
+    if logs:
+        q = q.outerjoin(JobLog, JobLog.job_id == job_row.job_id)
+    # yield_per also asks psycopg2 for a named (server-side) cursor.
+    q = q.filter(*criteria).order_by(*order).yield_per(batch)
+    for row in q:
+        yield row._asdict()
+
+
+# Implementations of resolve_references that only fill in `owner` and (for
+# group account jobs) `society`, which we can do ourselves.
+_BASE_RESOLVERS = (Job.resolve_references, SocietyJob.resolve_references)
+
+
+def resolve_references(jobs):
+    """
+    Resolve the references of a page of `jobs` together.
+
+    The owners and group accounts of all the jobs are loaded with one query
+    each, and set on each job directly -- that's all most job types refer to,
+    so a page costs two queries rather than one or two per job.  Job types
+    with references of their own (e.g. the member added by ChangeSocietyAdmin)
+    still run their own resolve_references afterwards, which looks those up
+    per job.
+    """
+    crsids = {job.owner_crsid for job in jobs} - {None}
+    names = {job.society_society for job in jobs if isinstance(job, SocietyJob)} - {None}
+    members = {}
+    societies = {}
+    if crsids:
+        members = {mem.crsid: mem for mem in sess.query(Member).filter(Member.crsid.in_(list(crsids)))}
+    if names:
+        societies = {soc.society: soc for soc in sess.query(Society).filter(Society.society.in_(list(names)))}
+    for job in jobs:
+        job.owner = members.get(job.owner_crsid)
+        if isinstance(job, SocietyJob):
+            job.society = societies.get(job.society_society)
+        if type(job).resolve_references not in _BASE_RESOLVERS:
+            job.resolve_references(sess)
+
+
+# Materialized view of per-job timings, from sql/job_timings.sql.
+job_timings = table(
+    "job_timings",
+    column("job_id"), column("type"), column("state"), column("created_at"),
+    column("approval_wait"), column("queue_wait"), column("run_time"), column("refreshed_at"),
+)
+
+# Percentiles reported by latency().
+LATENCY_PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def latency(since=None):
+    """
+    Summarise how long jobs (created after `since`, if given) spent waiting for
+    approval, waiting in the queue and running, per job type, from the
+    :data:`job_timings` view.
+
+    Returns a list of dicts of the job `type`, the number of jobs (`count`),
+    and for each of `approval_wait`, `queue_wait`, `wait` (the two together)
+    and `run_time`, a list of seconds at each of :data:`LATENCY_PERCENTILES`.
+    Types are ordered by how long their jobs wait at the 90th percentile,
+    longest first.
+    """
+    t = job_timings.c
+    stages = {
+        "approval_wait": t.approval_wait,
+        "queue_wait": t.queue_wait,
+        "wait": t.queue_wait + sql_func.coalesce(t.approval_wait, 0),
+        "run_time": t.run_time,
+    }
+    columns = [t.type, sql_func.count(t.job_id).label("count")]
+    for name, stage in stages.items():
+        for i, pc in enumerate(LATENCY_PERCENTILES):
+            columns.append(sql_func.percentile_cont(pc).within_group(stage).label("{}_{}".format(name, i)))
+    q = sess.query(*columns).select_from(job_timings).group_by(t.type)
+    if since:
+        q = q.filter(t.created_at >= since)
+    results = []
+    for row in q:
+        row = row._asdict()
+        summary = {"type": row["type"], "count": row["count"]}
+        for name in stages:
+            summary[name] = [row["{}_{}".format(name, i)] for i in range(len(LATENCY_PERCENTILES))]
+        results.append(summary)
+    # Only one row per job type, so this is cheap.
+    results.sort(key=lambda r: -(r["wait"][1] or 0))
+    return results
+
+
+def timings_available():
+    """Whether the :data:`job_timings` view has been created (by sql/job_timings.sql)."""
+    return sess.query(sql_func.to_regclass("job_timings")).scalar() is not None
+
+
+def timings_refreshed():
+    """When the :data:`job_timings` view was last refreshed, or None if it's empty."""
+    # Every row has the same value, so any will do.
+    return sess.query(job_timings.c.refreshed_at).select_from(job_timings).limit(1).scalar()
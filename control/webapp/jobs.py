@@ -1,13 +1,15 @@
 from datetime import datetime
+import json
 import math
+import time
 
-from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+from flask import Blueprint, flash, jsonify, redirect, render_template, request, Response, stream_with_context, url_for
 from werkzeug.exceptions import NotFound
 
 from srcf.controllib.jobs import Job, JobAction, JobActionInvalid, Signup, SocietyJob
 from srcf.database import JobLog
 
-from . import utils
+from . import inspect_services, job_events, job_queries, utils
 from .utils import srcf_db_sess as sess
 
 
@@ -15,42 +17,46 @@ bp = Blueprint("jobs", __name__)
 
 per_page = 25
 
+# States a job leaves by itself within moments, so worth holding a long-poll or
+# stream open for.  Anything else (e.g. awaiting approval, which can take days)
+# is left to the client to poll slowly, so idle tabs don't tie up workers.
+active_states = ("queued", "running")
+
+# How long (seconds) status_json may hold a ?wait= request, and status_events
+# a stream, before the client has to reconnect.
+long_poll_timeout = 25
+stream_timeout = 300
+stream_heartbeat = 15
+
+# Most jobs a single status_batch_json or status_events request may follow.
+max_watched = 50
+
+
+def _job_page(criterion):
+    args = utils.pagination_args()
+    jobs = job_queries.find_page([criterion], args["page"], per_page,
+                                 before=args["before"], after=args["after"])
+    max_pages = int(math.ceil(job_queries.count(criterion) / float(per_page)))
+    job_queries.resolve_references(jobs)
+    pages = utils.Pagination(args["page"], max_pages,
+                             first_key=jobs[0].job_id if jobs else None,
+                             last_key=jobs[-1].job_id if jobs else None)
+    return jobs, pages
+
 
 @bp.route('/jobs')
 def home():
-    # Best-effort parsing of ?page= falling back to 1 in all error cases
-    page = 1
-    try:
-        page = int(request.args["page"])
-    except (KeyError, ValueError):
-        pass
-
     crsid = utils.effective_crsid()
-    jobs = Job.find_by_user(sess, crsid)
-    max_pages = int(math.ceil(len(jobs) / float(per_page)))
-    jobs = jobs[min(len(jobs), per_page * (page - 1)):min(len(jobs), per_page * page)]
-    for job in jobs:
-        job.resolve_references(sess)
-    return render_template("jobs/home.html", owner_in_context=crsid, jobs=jobs, pages=utils.Pagination(page, max_pages), for_society=False)
+    jobs, pages = _job_page(job_queries.owned_by(crsid))
+    return render_template("jobs/home.html", owner_in_context=crsid, jobs=jobs, pages=pages, for_society=False)
 
 
 @bp.route('/jobs/<name>')
 def society_home(name):
     utils.find_mem_society(name)
 
-    # Best-effort parsing of ?page= falling back to 1 in all error cases
-    page = 1
-    try:
-        page = int(request.args["page"])
-    except (KeyError, ValueError):
-        pass
-
-    jobs = Job.find_by_society(sess, name)
-    max_pages = int(math.ceil(len(jobs) / float(per_page)))
-    jobs = jobs[min(len(jobs), per_page * (page - 1)):min(len(jobs), per_page * page)]
-    for job in jobs:
-        job.resolve_references(sess)
-    return render_template("jobs/home.html", owner_in_context=name, jobs=jobs, pages=utils.Pagination(page, max_pages), for_society=True)
+    jobs, pages = _job_page(job_queries.for_society(name))
+    return render_template("jobs/home.html", owner_in_context=name, jobs=jobs, pages=pages, for_society=True)
 
 
 @bp.route('/jobs/<int:id>')
@@ -63,6 +69,10 @@ def status(id):
     if not job.visible_to(crsid):
         raise NotFound(id)
 
+    if job.state in ("done", "failed") and not job_events.listener.connected:
+        # Otherwise the listener has already told every worker.
+        inspect_services.invalidate_for_job(job)
+
     for_society = isinstance(job, SocietyJob) and job.society is not None
     if job.owner is None:
         owner_in_context = None
@@ -87,14 +97,172 @@ def status(id):
     return render_template("jobs/status.html", job=job, for_society=for_society, owner_in_context=owner_in_context, job_home_url=job_home_url, member=mem)
 
 
+def _wait_for_change(states, timeout):
+    """
+    Block until any of the jobs in `states` (a dict of job ID to state) is no
+    longer in the given state, or `timeout` seconds pass.  Returns the jobs'
+    latest states.
+    """
+    deadline = time.monotonic() + timeout
+    with job_events.JobWatch(states) as watch:
+        while True:
+            # Read once subscribed (and after every wake-up), so a change made
+            # between the caller's read and the subscription isn't missed.
+            latest = job_queries.states_of(states)
+            # Don't sit in a transaction (and on a pooled connection) while we wait.
+            sess.commit()
+            if latest != states:
+                return latest
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            watch.wait(remaining)
+    return states
+
+
 @bp.route('/jobs/<int:id>.json')
 def status_json(id):
-    job = Job.find(sess, id)
-    if not job:
+    # Polled frequently, so avoid loading the whole job.
+    status = job_queries.status_of(id)
+    if not status:
         raise NotFound(id)
-    if not job.visible_to(utils.effective_crsid()):
+    if not _visible_ids([status]):
         raise NotFound(id)
-    return jsonify({"state": job.state})
+    # Long-polling: ?wait=<state> holds the request until the job leaves that state.
+    if request.args.get("wait") == status.state and status.state in active_states:
+        _wait_for_change({id: status.state}, long_poll_timeout)
+        status = job_queries.status_of(id)
+        if not status:
+            raise NotFound(id)
+    _invalidate_finished({id: status.state})
+
+    return _conditional(jsonify({"state": status.state}), [status])
+
+
+def _conditional(res, statuses):
+    """
+    Tag a status response with an ETag built from the jobs' states and latest
+    log entries, answering with 304 Not Modified if the client has it already.
+    """
+    res.set_etag(",".join("{}:{}:{}".format(status.job_id, status.state,
+                                             status.last_log.isoformat() if status.last_log else "")
+                          for status in sorted(statuses, key=lambda status: status.job_id)))
+    res.cache_control.private = True
+    res.cache_control.no_cache = True
+    return res.make_conditional(request)
+
+
+def _visible_ids(statuses):
+    """
+    IDs of those jobs (as :func:`job_queries.statuses_of` rows) the user may
+    follow: their own and their group accounts' jobs, or any job for admins
+    (who can also follow jobs from the admin view).
+    """
+    crsid = utils.effective_crsid()
+    visible = job_queries.visible_ids(statuses, crsid)
+    if len(visible) < len(statuses):
+        try:
+            if utils.is_admin(utils.get_member(crsid)):
+                visible = {status.job_id for status in statuses}
+        except KeyError:
+            pass
+    return visible
+
+
+def _watched_statuses():
+    """
+    Look up the jobs listed in ?ids= (comma-separated), returning a dict of
+    job ID to :func:`job_queries.statuses_of` row for those the user may see.
+    Raises NotFound if there are none, so clients stop asking.
+    """
+    ids = []
+    for part in request.args.get("ids", "").split(","):
+        try:
+            ids.append(int(part))
+        except ValueError:
+            pass
+    statuses = job_queries.statuses_of(ids[:max_watched])
+    visible = _visible_ids(list(statuses.values()))
+    if not visible:
+        raise NotFound
+    return {id: status for id, status in statuses.items() if id in visible}
+
+
+def _invalidate_finished(states):
+    """
+    Drop cached lookups made stale by any of the jobs that have finished --
+    only needed as a fallback, while the job listener isn't connected to tell
+    every worker itself.
+    """
+    if job_events.listener.connected:
+        return
+    for id, state in states.items():
+        if state in ("done", "failed"):
+            inspect_services.invalidate_for_job(Job.find(sess, id))
+
+
+@bp.route('/jobs/status.json')
+def status_batch_json():
+    """
+    States of several jobs at once, given as ?ids=1,2,3.  Passing the last
+    states seen, in the same order, as ?wait=queued,running,... holds the
+    request until one of them changes.
+    """
+    statuses = _watched_statuses()
+    states = {id: status.state for id, status in statuses.items()}
+    ids = request.args.get("ids", "").split(",")
+    seen = dict(zip(ids, request.args.get("wait", "").split(",")))
+    if "wait" in request.args and all(seen.get(str(id)) == state for id, state in states.items()):
+        if any(state in active_states for state in states.values()):
+            if _wait_for_change(states, long_poll_timeout) != states:
+                statuses = job_queries.statuses_of(states)
+                states = {id: status.state for id, status in statuses.items()}
+    _invalidate_finished(states)
+    return _conditional(jsonify({"jobs": {str(id): state for id, state in states.items()}}),
+                        statuses.values())
+
+
+@bp.route('/jobs/events.stream')
+def status_events():
+    """
+    Server-sent event stream of the states of the jobs in ?ids=1,2,3.  Once
+    none of them are queued or running, sends an `idle` event and ends, and
+    the client should fall back to polling status_batch_json slowly.
+    """
+    states = {id: status.state for id, status in _watched_statuses().items()}
+
+    def event(id, state):
+        return "event: state\ndata: {}\n\n".format(json.dumps({"job_id": id, "state": state}))
+
+    def stream(states):
+        yield "retry: 5000\n"
+        for id, state in states.items():
+            yield event(id, state)
+        deadline = time.monotonic() + stream_timeout
+        with job_events.JobWatch(states) as watch:
+            while True:
+                # Read once subscribed, and again after every wake-up or
+                # heartbeat, so a change made before the subscription (whose
+                # notification we never saw) still gets picked up.
+                latest = job_queries.states_of(states)
+                sess.commit()
+                changed = {id: state for id, state in latest.items() if states[id] != state}
+                for id, state in changed.items():
+                    yield event(id, state)
+                _invalidate_finished(changed)
+                # Stop following any jobs that have since been deleted.
+                states = {id: state for id, state in latest.items() if id in states}
+                if not any(state in active_states for state in states.values()):
+                    yield "event: idle\ndata: {}\n\n"
+                    break
+                if time.monotonic() >= deadline:
+                    break
+                if not watch.wait(stream_heartbeat):
+                    # Nothing happened -- keep the connection alive.
+                    yield ": keepalive\n\n"
+
+    return Response(stream_with_context(stream(states)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @bp.route('/jobs/<int:id>/withdraw')
@@ -1,7 +1,7 @@
 import re
 import string
 
-from flask import Blueprint, redirect, render_template, request, url_for
+from flask import Blueprint, jsonify, redirect, render_template, request, url_for
 from werkzeug.exceptions import Forbidden, NotFound
 
 from srcf import domains
@@ -9,7 +9,7 @@ from srcf.controllib import jobs
 from srcf.controllib.utils import validate_list_name
 from srcf.database import Domain
 
-from . import inspect_services, utils
+from . import inspect_services, job_queries, utils
 from .utils import create_job_maybe_email_and_redirect, effective_member, parse_domain_name, srcf_db_sess as sess
 
 
@@ -22,12 +22,26 @@ def home():
     if not mem.user:
         return redirect(url_for('member.reactivate'))
 
-    inspect_services.lookup_all(mem)
+    # Service cards are filled in by service_card, unless we've been asked to
+    # render everything up front (e.g. for browsers without JavaScript).
+    inline = bool(request.args.get("inline"))
+    if inline:
+        inspect_services.lookup_all(mem)
 
-    pending = [job for job in jobs.Job.find_by_user(sess, mem.crsid) if job.state == "unapproved"]
-    for job in pending:
-        job.resolve_references(sess)
-    return render_template("member/home.html", member=mem, pending=pending)
+    pending = job_queries.pending(job_queries.owned_by(mem.crsid))
+    job_queries.resolve_references(pending)
+    return render_template("member/home.html", member=mem, pending=pending, services_inline=inline)
+
+
+@bp.route('/member/services/<kind>.json')
+def service_card(kind):
+    mem = effective_member()
+    try:
+        only = inspect_services.SERVICE_KINDS[kind]
+    except KeyError:
+        raise NotFound(kind)
+    inspect_services.lookup_all(mem, only=only)
+    return jsonify({"html": render_template("member/services/{}.html".format(kind), member=mem)})
 
 
 @bp.route("/reactivate", methods=["GET", "POST"])
@@ -137,11 +151,11 @@ def create_mailing_list():
             except ValueError as ex:
                 error = ex.args[0]
         if not error:
-            lists = inspect_services.lookup_mailinglists(mem.crsid)
-            if "{}-{}".format(mem.crsid, listname) in lists:
+            if inspect_services.mailinglist_exists(mem.crsid, "{}-{}".format(mem.crsid, listname)):
                 error = "This mailing list already exists."
 
     if request.method == "POST" and not error:
+        inspect_services.invalidate_mailinglists(mem.crsid)
         return create_job_maybe_email_and_redirect(
                     jobs.CreateUserMailingList, member=mem,
                     listname=listname)
@@ -153,8 +167,7 @@ def create_mailing_list():
 def reset_mailing_list_password(listname):
     mem = effective_member()
 
-    lists = inspect_services.lookup_mailinglists(mem.crsid)
-    if listname not in lists:
+    if not inspect_services.mailinglist_exists(mem.crsid, listname):
         raise NotFound
 
     if request.method == "POST":
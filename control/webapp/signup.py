@@ -1,12 +1,16 @@
+import os
 import re
+import threading
+import time
 
-from flask import Blueprint, redirect, render_template, request, url_for
+from flask import Blueprint, jsonify, redirect, render_template, request, url_for
 from sqlalchemy.sql.expression import func
+from werkzeug.exceptions import Forbidden
 
 from srcf.controllib import jobs
 from srcf.database import Member, Society
 
-from . import utils
+from . import job_events, utils
 from .utils import create_job_maybe_email_and_redirect, srcf_db_sess as sess
 
 
@@ -66,7 +70,7 @@ def signup():
             surname = lookup_user["sn"][0]
             preferred_name = ""
             email = crsid + "@cam.ac.uk"
-        except KeyError:
+        except (KeyError, IndexError):
             preferred_name = ""
             surname = ""
             email = ""
@@ -97,6 +101,172 @@ def make_keywords(desc):
     return keywords
 
 
+class SocietyKeywordIndex(object):
+    """
+    Inverted index from description keywords (see :func:`make_keywords`) to
+    the group accounts using them, built from one query over all societies.
+
+    The index is rebuilt when the job listener reports a group account being
+    created or renamed, or if the listener isn't connected, once it's older
+    than `ttl` seconds.
+    """
+
+    # Jobs that change the set of descriptions once done.
+    job_types = (jobs.CreateSociety.JOB_TYPE, jobs.UpdateSocietyDescription.JOB_TYPE)
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._by_keyword = {}
+        self._keywords = {}
+        self._built = None
+        self._stale = True
+        self._lock = threading.Lock()
+        # Held for the whole of a rebuild, so concurrent callers wait for it
+        # rather than starting their own or reading a half-built index.
+        self._build_lock = threading.Lock()
+
+    def on_event(self, event):
+        if event is None or (event.get("state") == "done" and event.get("type") in self.job_types):
+            self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def _fresh(self):
+        # Call with `_lock` held.
+        if self._built is None or self._stale:
+            return False
+        return job_events.listener.connected or time.monotonic() - self._built < self.ttl
+
+    def _ensure(self):
+        job_events.listener.start()
+        with self._lock:
+            if self._fresh():
+                return
+        with self._build_lock:
+            with self._lock:
+                # Another caller may have rebuilt while we waited.
+                if self._fresh():
+                    return
+                # Anything invalidating us from here on needs another rebuild.
+                self._stale = False
+            built = time.monotonic()
+            by_keyword = {}
+            keywords = {}
+            try:
+                for name, description in sess.query(Society.society, Society.description):
+                    keywords[name] = frozenset(make_keywords(description or ""))
+                    for word in keywords[name]:
+                        by_keyword.setdefault(word, set()).add(name)
+            except Exception:
+                # Try again next time, rather than carrying on with an empty index.
+                with self._lock:
+                    self._stale = True
+                raise
+            with self._lock:
+                self._by_keyword = by_keyword
+                self._keywords = keywords
+                self._built = built
+
+    def matches(self, words):
+        """
+        Return the names of group accounts whose keywords are exactly `words`,
+        and of those whose keywords include all of `words`.
+        """
+        if not words:
+            return [], []
+        self._ensure()
+        with self._lock:
+            candidates = set.intersection(*(self._by_keyword.get(word, set()) for word in words))
+            exact = sorted(name for name in candidates if self._keywords[name] == words)
+        return exact, sorted(candidates.difference(exact))
+
+
+society_keywords = SocietyKeywordIndex(float(os.getenv("SOCIETY_KEYWORDS_TTL", "60")))
+job_events.listener.subscribe(society_keywords.on_event)
+
+
+def check_society(society=None, description=None):
+    """
+    Validate a proposed group account short name and/or full name, skipping
+    either if None.
+
+    Returns a dict of errors by field (with any clashing group account as
+    `existing`), and a list of group accounts with similar full names.
+    """
+    errors = {}
+    similar = []
+
+    if society is not None:
+        if not society:
+            errors["society"] = "Please enter a group account short name."
+        elif len(society) > 16:
+            errors["society"] = "Group account short names must be no longer than 16 characters."
+        elif not SOC_SOCIETY_RE.match(society):
+            errors["society"] = "Group account short names may only contain lowercase letters."
+
+        try:
+            soc = utils.get_society(society)
+        except KeyError:
+            pass
+        else:
+            errors["existing"] = soc
+            errors["society"] = "A group account with this short name already exists."
+
+    if description is None:
+        return errors, similar
+
+    keywords = make_keywords(description)
+    if not description:
+        errors["description"] = "Please enter the full name of the group."
+        return errors, similar
+    elif ILLEGAL_NAME_RE.search(description):
+        errors["description"] = ILLEGAL_NAME_ERR
+    elif not keywords:
+        errors["description"] = "Please use a more descriptive full name."
+
+    # Backed by the index on lower(description) in sql/society_indexes.sql.
+    soc = sess.query(Society).filter(func.lower(Society.description) == description.lower()).first()
+    if soc:
+        if "existing" not in errors:
+            errors["existing"] = soc
+        errors["description"] = "A group account with this full name already exists."
+
+    if "existing" not in errors:
+        exact, superset = society_keywords.matches(keywords)
+        if exact or superset:
+            # Only load the candidates (skipping any removed since the index was built).
+            found = {soc.society: soc for soc in sess.query(Society).filter(Society.society.in_(exact + superset))}
+            exact = [found[name] for name in exact if name in found]
+            if exact:
+                errors["existing"] = exact[0]
+                errors["description"] = "A group account with a matching full name already exists."
+            else:
+                similar = [found[name] for name in superset if name in found]
+
+    return errors, similar
+
+
+@bp.route("/signup/society/check.json")
+def newsoc_check():
+    """
+    Check a group account short name and/or full name as they're typed into
+    the newsoc form, given as ?society= and ?description= (either may be left
+    out to skip it).
+    """
+    if not utils.effective_member(allow_inactive=True, allow_unregistered=True):
+        raise Forbidden
+
+    errors, similar = check_society(request.args.get("society"), request.args.get("description"))
+    existing = errors.pop("existing", None)
+    return jsonify({
+        "errors": errors,
+        "existing": {"society": existing.society, "description": existing.description} if existing else None,
+        "similar": [{"society": soc.society, "description": soc.description} for soc in similar],
+    })
+
+
 @bp.route("/signup/society", methods=["get", "post"])
 def newsoc():
     mem = utils.effective_member(allow_inactive=True, allow_unregistered=True)
@@ -131,45 +301,8 @@ def newsoc():
                                 "reactivate their accounts by logging to the SRCF Control Panel: {0}"
                                 .format(", ".join(sorted(x.crsid for x in member_admins if x not in current_admins))))
 
-        if not values["society"]:
-            errors["society"] = "Please enter a group account short name."
-        elif len(values["society"]) > 16:
-            errors["society"] = "Group account short names must be no longer than 16 characters."
-        elif not SOC_SOCIETY_RE.match(values["society"]):
-            errors["society"] = "Group account short names may only contain lowercase letters."
-
-        keywords = make_keywords(values["description"])
-        if not values["description"]:
-            errors["description"] = "Please enter the full name of the group."
-        elif ILLEGAL_NAME_RE.search(values["description"]):
-            errors["description"] = ILLEGAL_NAME_ERR
-        elif not keywords:
-            errors["description"] = "Please use a more descriptive full name."
-
-        try:
-            soc = utils.get_society(values["society"])
-        except KeyError:
-            pass
-        else:
-            errors["existing"] = soc
-            errors["society"] = "A group account with this short name already exists."
-
-        soc = sess.query(Society).filter(func.lower(Society.description) == values["description"].lower()).first()
-        if soc:
-            if "existing" not in errors:
-                errors["existing"] = soc
-            errors["description"] = "A group account with this full name already exists."
-
-        similar = []
-        if "existing" not in errors:
-            for soc in sess.query(Society):
-                words = make_keywords(soc.description)
-                if keywords == words:
-                    errors["existing"] = soc
-                    errors["description"] = "A group account with a matching full name already exists."
-                    break
-                elif keywords <= words:
-                    similar.append(soc)
+        checked, similar = check_society(values["society"], values["description"])
+        errors.update(checked)
 
         if request.form.get("edit") or errors:
             return render_template("signup/newsoc.html", errors=errors, **values)
@@ -1,7 +1,7 @@
 import re
 import string
 
-from flask import Blueprint, redirect, render_template, request, url_for
+from flask import Blueprint, jsonify, redirect, render_template, request, url_for
 from werkzeug.exceptions import BadRequest, Forbidden, NotFound
 
 from srcf import domains
@@ -9,7 +9,7 @@ from srcf.controllib import jobs
 from srcf.controllib.utils import validate_list_name
 from srcf.database import Domain
 
-from . import inspect_services, utils
+from . import inspect_services, job_queries, utils
 from .utils import create_job_maybe_email_and_redirect, find_mem_society, parse_domain_name, srcf_db_sess as sess
 
 
@@ -40,13 +40,26 @@ def validate_soc_role_email(email):
 def home(society):
     mem, soc = find_mem_society(society)
 
-    inspect_services.lookup_all(mem)
-    inspect_services.lookup_all(soc)
+    # Service cards are filled in by service_card, unless we've been asked to
+    # render everything up front (e.g. for browsers without JavaScript).
+    inline = bool(request.args.get("inline"))
+    if inline:
+        inspect_services.lookup_all(soc)
 
-    pending = [job for job in jobs.Job.find_by_society(sess, soc.society) if job.state == "unapproved"]
-    for job in pending:
-        job.resolve_references(sess)
-    return render_template("society/home.html", member=mem, society=soc, pending=pending)
+    pending = job_queries.pending(job_queries.for_society(soc.society))
+    job_queries.resolve_references(pending)
+    return render_template("society/home.html", member=mem, society=soc, pending=pending, services_inline=inline)
+
+
+@bp.route('/societies/<society>/services/<kind>.json')
+def service_card(society, kind):
+    mem, soc = find_mem_society(society)
+    try:
+        only = inspect_services.SERVICE_KINDS[kind]
+    except KeyError:
+        raise NotFound(kind)
+    inspect_services.lookup_all(soc, only=only)
+    return jsonify({"html": render_template("society/services/{}.html".format(kind), member=mem, society=soc)})
 
 
 @bp.route("/societies/<society>/description", methods=["GET", "POST"])
@@ -183,11 +196,11 @@ def create_mailing_list(society):
             except ValueError as ex:
                 error = ex.args[0]
         if not error:
-            lists = inspect_services.lookup_mailinglists(society)
-            if "{}-{}".format(society, listname) in lists:
+            if inspect_services.mailinglist_exists(society, "{}-{}".format(society, listname)):
                 error = "This mailing list already exists."
 
     if request.method == "POST" and not error:
+        inspect_services.invalidate_mailinglists(society)
         return create_job_maybe_email_and_redirect(
             jobs.CreateSocietyMailingList,
             member=mem, society=soc, listname=listname
@@ -200,8 +213,7 @@ def create_mailing_list(society):
 def reset_mailing_list_password(society, listname):
     mem, soc = find_mem_society(society)
 
-    lists = inspect_services.lookup_mailinglists(society)
-    if listname not in lists:
+    if not inspect_services.mailinglist_exists(society, listname):
         raise NotFound
 
     if request.method == "POST":
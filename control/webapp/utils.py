@@ -1,12 +1,20 @@
+from collections import OrderedDict
 from datetime import datetime
 from functools import partial
+import logging
 import os
 import sys
+import threading
+import time
 import traceback
-from urllib.parse import urlparse
+from types import SimpleNamespace
+from urllib.parse import urlencode, urlparse
 
 import flask
 import jinja2
+import ldap3
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.conv import escape_filter_chars
 import sqlalchemy.orm
 import werkzeug.exceptions
 from werkzeug.exceptions import BadRequest, Forbidden, HTTPException, NotFound
@@ -14,8 +22,8 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 import yaml
 
 from srcf.controllib.jobs import CreateSociety, Reactivate, Signup, SocietyJob
-from srcf.controllib.utils import email_re, is_admin, ldapsearch, mysql_conn
-from srcf.database import JobLog, queries, Session
+from srcf.controllib.utils import email_re, is_admin, mysql_conn
+from srcf.database import JobLog, Member, queries, Session, Society
 from srcf.mail import mail_sysadmins
 import ucam_webauth
 import ucam_webauth.flask_glue
@@ -24,7 +32,9 @@ import ucam_webauth.raven.flask_glue
 import ucam_webauth.rsa
 
 __all__ = ["email_re", "auth", "raven", "srcf_db_sess", "get_member", "get_society",
-           "temp_mysql_conn", "setup_app", "ldapsearch", "auth_admin", "DOMAIN_WEB"]
+           "temp_mysql_conn", "mysql_pool", "setup_app", "ldapsearch", "auth_admin", "DOMAIN_WEB"]
+
+LOG = logging.getLogger(__name__)
 
 
 DOMAIN_WEB = os.getenv("DOMAIN_WEB", "https://www.srcf.net")
@@ -71,14 +81,240 @@ get_member = partial(queries.get_member, session=srcf_db_sess)
 get_society = partial(queries.get_society, session=srcf_db_sess)
 
 
+class MySQLPool(object):
+    """
+    A per-worker pool of MySQL connections, keeping up to `max_size` idle.
+
+    Idle connections are pinged before being handed out again, and closed
+    instead once they've sat unused for more than `max_idle` seconds.
+    """
+
+    def __init__(self, connect, max_size, max_idle):
+        self.connect = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = {"checkouts": 0, "opened": 0, "reused": 0, "recycled": 0, "broken": 0, "in_use": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def acquire(self):
+        self._count("checkouts")
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                since, conn = self._idle.pop()
+            if time.monotonic() - since > self.max_idle:
+                self._count("recycled")
+                self._close(conn)
+                continue
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._count("broken")
+                self._close(conn)
+                continue
+            self._count("reused")
+            self._count("in_use")
+            return conn
+        conn = self.connect()
+        self._count("opened")
+        self._count("in_use")
+        return conn
+
+    def release(self, conn):
+        self._count("in_use", -1)
+        try:
+            # End any open transaction, so the next borrower gets a fresh snapshot.
+            conn.rollback()
+        except Exception:
+            self._count("broken")
+            self._close(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((time.monotonic(), conn))
+                return
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            LOG.debug("Error closing pooled MySQL connection", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+
+mysql_pool = MySQLPool(mysql_conn,
+                       max_size=int(os.getenv("MYSQL_POOL_SIZE", "6")),
+                       max_idle=float(os.getenv("MYSQL_POOL_IDLE", "300")))
+
+
 # We occasionally need a temporary MySQL connection
 def temp_mysql_conn():
     if not hasattr(flask.g, "mysql"):
-        # A throwaway connection
-        flask.g.mysql = mysql_conn()
+        # Borrowed from the pool until the end of the request
+        flask.g.mysql = mysql_pool.acquire()
     return flask.g.mysql
 
 
+class TTLCache(object):
+    """
+    A small thread-safe LRU cache, holding at most `maxsize` entries, each of
+    which expires `ttl` seconds after it was stored.
+
+    To avoid storing a value fetched before an invalidation landed, read
+    `generation` before fetching and pass it to `set`, which then drops the
+    value if anything was invalidated in between.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+
+class LDAPClient(object):
+    """
+    A per-worker client for University directory (lookup) searches, keeping up
+    to `pool_size` bound connections open between requests, and the results
+    of recent searches for `cache_ttl` seconds.
+
+    Connecting and each search give up after `timeout` seconds.  `host` may be
+    any LDAP URL, e.g. a local stand-in server for testing.
+    """
+
+    def __init__(self, host, base, attributes, timeout, pool_size, max_idle, cache_ttl, cache_size=256):
+        self.server = ldap3.Server(host, connect_timeout=timeout, get_info=ldap3.NONE)
+        self.base = base
+        self.attributes = attributes
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self._cache = TTLCache(cache_size, cache_ttl)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                since, conn = self._idle.pop()
+            if time.monotonic() - since > self.max_idle or conn.closed:
+                self._close(conn)
+                continue
+            return conn
+        return ldap3.Connection(self.server, auto_bind=True, read_only=True, receive_timeout=self.timeout)
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((time.monotonic(), conn))
+                return
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind()
+        except Exception:
+            LOG.debug("Error closing pooled LDAP connection", exc_info=True)
+
+    def search(self, crsid):
+        """
+        Look up `crsid`, returning a dict of their attributes (each a list of
+        values), or None if there's no such person.  Raises LDAPException (or
+        OSError) if the directory can't be reached.
+        """
+        found = self._cache.get(crsid, False)
+        if found is not False:
+            return found
+        conn = self._acquire()
+        try:
+            conn.search(self.base, "(uid={})".format(escape_filter_chars(crsid)), attributes=self.attributes)
+            entries = conn.entries
+        except Exception:
+            # Don't hand out a connection in an unknown state.
+            self._close(conn)
+            raise
+        self._release(conn)
+        found = entries[0].entry_attributes_as_dict if len(entries) == 1 else None
+        self._cache.set(crsid, found)
+        return found
+
+
+ldap_client = LDAPClient(os.getenv("LDAP_HOST", "ldap://ldap.lookup.cam.ac.uk"),
+                         os.getenv("LDAP_BASE", "ou=people,o=University of Cambridge,dc=cam,dc=ac,dc=uk"),
+                         attributes=["uid", "cn", "sn", "displayName", "mail"],
+                         timeout=float(os.getenv("LDAP_TIMEOUT", "3")),
+                         pool_size=int(os.getenv("LDAP_POOL_SIZE", "2")),
+                         max_idle=float(os.getenv("LDAP_POOL_IDLE", "60")),
+                         cache_ttl=float(os.getenv("LDAP_CACHE_TTL", "600")))
+
+
+def ldapsearch(crsid):
+    """
+    Look up `crsid` in the University directory, returning a dict of their
+    attributes (each a list of values).  Raises KeyError if they're not found,
+    or if the directory is unavailable, so callers fall back to defaults.
+    """
+    try:
+        found = ldap_client.search(crsid)
+    except (LDAPException, OSError):
+        LOG.warning("LDAP lookup of %s failed", crsid, exc_info=True)
+        raise KeyError(crsid)
+    if not found:
+        raise KeyError(crsid)
+    return found
+
+
 def parse_domain_name(domain):
     parsed = urlparse(domain.lower())
     domain = parsed.netloc or parsed.path.split("/", 1)[0]
@@ -104,9 +340,15 @@ class Pagination(object):
 
     context = 3
 
-    def __init__(self, current, total):
+    def __init__(self, current, total, first_key=None, last_key=None, params=None):
         self.current = current
         self.total = total
+        # Other query parameters (e.g. search filters) to carry between pages.
+        self.params = params or {}
+        # Keys of the first and last items shown, used as keyset cursors when
+        # stepping to an adjacent page.
+        self.first_key = first_key
+        self.last_key = last_key
 
     @property
     def show(self):
@@ -126,6 +368,29 @@ class Pagination(object):
     def __iter__(self):
         return iter(self.pages)
 
+    def query(self, page):
+        """Query string linking to `page`."""
+        args = dict(self.params, page=page)
+        if page == self.current + 1 and self.last_key is not None:
+            args["before"] = self.last_key
+        elif page == self.current - 1 and self.first_key is not None:
+            args["after"] = self.first_key
+        return "?" + urlencode(args)
+
+
+def pagination_args():
+    """
+    Best-effort parsing of ?page= (falling back to 1) and the ?before= or
+    ?after= keyset cursors (ignored) in all error cases.
+    """
+    args = {"page": 1, "before": None, "after": None}
+    for key in args:
+        try:
+            args[key] = int(flask.request.args[key])
+        except (KeyError, ValueError):
+            pass
+    return args
+
 
 def generic_error_handler(error):
     if isinstance(error, HTTPException):
@@ -169,7 +434,7 @@ def setup_app(app):
     def teardown_request(res):
         srcf_db_sess.remove()
         if hasattr(flask.g, "mysql"):
-            flask.g.mysql.close()
+            mysql_pool.release(flask.g.mysql)
         return res
 
     app.jinja_env.globals["sif"] = sif
@@ -238,6 +503,48 @@ def create_job_maybe_email_and_redirect(cls, *args, **kwargs):
     return flask.redirect(url)
 
 
+def _load_societies(ident, mem):
+    """
+    Load `mem`'s group accounts and their admins in one query, ready for
+    `find_mem_society` and templates -- at most once per member per request.
+    The joined load fills in the collections on the already-loaded `mem`.
+    """
+    if mem.crsid in ident.societies_loaded:
+        return
+    (srcf_db_sess.query(Member)
+     .options(sqlalchemy.orm.joinedload(Member.societies).joinedload(Society.admins))
+     .filter(Member.crsid == mem.crsid)
+     .one())
+    ident.societies_loaded.add(mem.crsid)
+
+
+def _identity():
+    """
+    Resolve who the request is from, and who they're acting as, once per
+    request: the authenticated principal and their Member record, whether
+    they're an admin, and any `SRCF-Principal-Override`.
+
+    This only costs a primary key lookup, as it's on the path of every status
+    poll; `effective_member` fills in the rest as needed.
+    """
+    assert auth.principal
+    ident = getattr(flask.g, "identity", None)
+    if ident is not None and ident.principal == auth.principal:
+        return ident
+    ident = SimpleNamespace(principal=auth.principal, member=None, admin=False, override=None,
+                            override_member=None, override_loaded=False, societies_loaded=set())
+    try:
+        ident.member = get_member(ident.principal)
+    except KeyError:
+        pass
+    else:
+        ident.admin = is_admin(ident.member)
+    if ident.admin:
+        ident.override = flask.request.headers.get("SRCF-Principal-Override") or None
+    flask.g.identity = ident
+    return ident
+
+
 def effective_crsid():
     """
     Return the CRSid of the authenticated user from their Raven or Goose authentication data.
@@ -245,16 +552,8 @@ def effective_crsid():
     If the `SRCF-Principal-Override` header is set, admins may override the authentication data in
     order to impersonate another user.
     """
-    assert auth.principal
-    crsid = auth.principal
-    try:
-        mem = get_member(crsid)
-    except KeyError:
-        return crsid
-    if not is_admin(mem):
-        return crsid
-    override = flask.request.headers.get("SRCF-Principal-Override")
-    return override or crsid
+    ident = _identity()
+    return ident.override or ident.principal
 
 
 def effective_member(allow_inactive=False, allow_unregistered=False):
@@ -268,29 +567,26 @@ def effective_member(allow_inactive=False, allow_unregistered=False):
     If the `SRCF-Principal-Override` header is set, admins may override the authentication data in
     order to impersonate another user.
     """
-    assert auth.principal
-    crsid = auth.principal
-    try:
-        mem = get_member(crsid)
-        if not mem.member:
-            raise KeyError(crsid)
-    except KeyError:
+    ident = _identity()
+    mem = ident.member
+    if not mem or not mem.member:
         if allow_unregistered:
             return None
         else:
             raise NotFound
     if not mem.user and not allow_inactive:
         raise InactiveUser
-    if not is_admin(mem):
-        return mem
-    override = flask.request.headers.get("SRCF-Principal-Override")
-    if not override:
+    if not ident.override:
+        _load_societies(ident, mem)
         return mem
-    try:
-        alt = get_member(override)
-        if not alt.member:
-            raise KeyError(crsid)
-    except KeyError:
+    if not ident.override_loaded:
+        try:
+            ident.override_member = get_member(ident.override)
+        except KeyError:
+            pass
+        ident.override_loaded = True
+    alt = ident.override_member
+    if not alt or not alt.member:
         if allow_unregistered:
             return None
         else:
@@ -298,27 +594,35 @@ def effective_member(allow_inactive=False, allow_unregistered=False):
     if not alt.user and not allow_inactive:
         raise InactiveUser
     else:
+        _load_societies(ident, alt)
         return alt
 
 
 def find_mem_society(society):
     try:
         mem = effective_member()
-        soc = get_society(society)
     except KeyError:
         raise NotFound
     if not mem.user:
         raise InactiveUser
 
-    if mem not in soc.admins:
-        raise Forbidden
+    # The member's group accounts (and their admins) are already loaded.
+    for soc in mem.societies:
+        if soc.society == society:
+            return mem, soc
 
-    return mem, soc
+    try:
+        get_society(society)
+    except KeyError:
+        raise NotFound
+    raise Forbidden
 
 
 def auth_admin():
     mem = effective_member()
-    if not is_admin(mem):
+    ident = _identity()
+    # Reuse the principal's admin check, unless they're impersonating someone.
+    if not (ident.admin if mem is ident.member else is_admin(mem)):
         raise Forbidden
 
 
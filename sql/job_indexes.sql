@@ -0,0 +1,26 @@
+-- Indexes backing the control panel's job history pages.  These live in the
+-- shared SRCF database, so apply them by hand as a database admin:
+--
+--     psql sysadmins < sql/job_indexes.sql
+
+-- Job history for a user or group account, newest first (jobs.home,
+-- jobs.society_home).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_owner_crsid_job_id_idx
+    ON jobs (owner_crsid, job_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_society_job_id_idx
+    ON jobs ((args -> 'society'), job_id);
+
+-- Jobs in a given state, newest first (admin.view_jobs).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_state_job_id_idx
+    ON jobs (state, job_id);
+
+-- Log entries of a given type per job, e.g. note counts (admin.view_jobs).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS job_log_job_id_type_idx
+    ON job_log (job_id, type);
+
+-- Jobs awaiting approval for a user or group account (member.home,
+-- society.home).  Partial, so they stay small however long the history gets.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_unapproved_owner_crsid_idx
+    ON jobs (owner_crsid, job_id) WHERE state = 'unapproved';
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_unapproved_society_idx
+    ON jobs ((args -> 'society'), job_id) WHERE state = 'unapproved';
@@ -0,0 +1,25 @@
+-- Announce job state changes on the control_job_state channel, which the
+-- control panel listens on (see control/webapp/job_events.py) to keep its
+-- caches fresh.  Apply by hand as a database admin:
+--
+--     psql sysadmins < sql/job_notify.sql
+
+CREATE OR REPLACE FUNCTION control_notify_job_state() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.state IS DISTINCT FROM OLD.state THEN
+        PERFORM pg_notify('control_job_state', json_build_object(
+            'job_id', NEW.job_id,
+            'state', NEW.state,
+            'type', NEW.type,
+            'owner', NEW.owner_crsid,
+            'society', NEW.args -> 'society'
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS control_notify_job_state ON jobs;
+CREATE TRIGGER control_notify_job_state
+    AFTER INSERT OR UPDATE OF state ON jobs
+    FOR EACH ROW EXECUTE PROCEDURE control_notify_job_state();
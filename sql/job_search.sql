@@ -0,0 +1,17 @@
+-- Indexes backing the admin job search (admin.search_jobs).  Apply by hand as
+-- a database admin, like sql/job_indexes.sql:
+--
+--     psql sysadmins < sql/job_search.sql
+
+-- Full-text search over log messages and raw output.  The expression must
+-- match job_queries.log_document() exactly for the planner to use it.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS job_log_document_idx
+    ON job_log USING gin (to_tsvector('english'::regconfig, coalesce(message, '') || ' ' || coalesce(raw, '')));
+
+-- Jobs of a given type, newest first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_type_job_id_idx
+    ON jobs (type, job_id);
+
+-- Jobs created within a date range.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS jobs_created_at_idx
+    ON jobs (created_at);
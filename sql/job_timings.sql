@@ -0,0 +1,56 @@
+-- Per-job timings for the admin latency dashboard (admin.job_latency),
+-- worked out once from job_log rather than on every page view.  Apply by hand
+-- as a database admin:
+--
+--     psql sysadmins < sql/job_timings.sql
+--
+-- then refresh it periodically (e.g. hourly from cron):
+--
+--     psql sysadmins -c 'REFRESH MATERIALIZED VIEW CONCURRENTLY job_timings'
+--
+-- This keeps one row per job, not a per-type or per-day rollup: the dashboard
+-- reports exact percentiles over windows of any length, and percentiles of
+-- daily buckets can't be combined into those.  A row is a few dozen bytes, so
+-- even the full history is cheap to aggregate (and admin.job_latency caches
+-- the result).
+--
+-- Re-running this file recreates the view, picking up any changes here; the
+-- dashboard reports it missing until the CREATE commits.
+
+DROP MATERIALIZED VIEW IF EXISTS job_timings;
+
+CREATE MATERIALIZED VIEW job_timings AS
+    WITH marks AS (
+        SELECT
+            jobs.job_id,
+            jobs.type,
+            jobs.state,
+            coalesce(min(job_log.time) FILTER (WHERE job_log.type = 'created'), jobs.created_at) AS created_at,
+            -- Logged by admin.set_state and admin.bulk_set_state, with the
+            -- action in raw.  Older entries only have it in the message.
+            -- Approvals made any other way aren't logged, so those jobs'
+            -- approval wait counts as queue wait instead.
+            min(job_log.time) FILTER (WHERE job_log.type = 'progress'
+                                      AND (job_log.raw = 'approve'
+                                           OR job_log.message LIKE 'Admin state change: job approved %')) AS approved_at,
+            min(job_log.time) FILTER (WHERE job_log.type = 'started') AS started_at,
+            max(job_log.time) FILTER (WHERE job_log.type IN ('done', 'failed')) AS finished_at
+        FROM jobs
+        LEFT JOIN job_log ON job_log.job_id = jobs.job_id
+        GROUP BY jobs.job_id
+    )
+    SELECT
+        marks.*,
+        extract(epoch FROM approved_at - created_at) AS approval_wait,
+        extract(epoch FROM started_at - coalesce(approved_at, created_at)) AS queue_wait,
+        extract(epoch FROM finished_at - started_at) AS run_time,
+        now() AS refreshed_at
+    FROM marks;
+
+-- Required for REFRESH ... CONCURRENTLY.
+CREATE UNIQUE INDEX job_timings_job_id_idx
+    ON job_timings (job_id);
+
+-- Timings of jobs created within a window, by type.
+CREATE INDEX job_timings_created_at_type_idx
+    ON job_timings (created_at, type);
@@ -0,0 +1,9 @@
+-- Indexes backing the group account signup checks (signup.newsoc and its
+-- live check, signup.newsoc_check).  Apply by hand as a database admin:
+--
+--     psql sysadmins < sql/society_indexes.sql
+
+-- Case-insensitive full name clashes.  Short names are already covered by
+-- the primary key.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS societies_lower_description_idx
+    ON societies (lower(description));